@@ -0,0 +1,463 @@
+"""
+Benchmarks of the replies matching and response paths.
+
+Every case is timed over repeated runs and reported as seconds per
+operation, in a json file meant to be compared across versions::
+
+    python benchmarks/bench.py -o before.json
+    git checkout my-branch
+    python benchmarks/bench.py -o after.json --compare before.json
+
+``--quick`` drops the largest cases, ``-k`` only runs the cases whose id
+contains one of the given strings. ``--compare`` exits with status 1 when
+a case got slower than ``--threshold`` times its baseline median.
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import asks  # noqa: E402
+import multio  # noqa: E402
+
+import replies  # noqa: E402
+from replies._asks import Request, ResponseTemplate  # noqa: E402
+from replies._registry import RegexIndex, Route  # noqa: E402
+from replies._utils import BodyReader  # noqa: E402
+
+
+FORMAT_VERSION = 1
+
+# how long the timed loop of a case should last, and how many times it runs
+TARGET_TIME = 0.2
+REPEAT = 5
+
+KB = 1024
+MB = 1024 * KB
+
+
+class SkipCase(Exception):
+    """Raised by a benchmark that cannot run here, with the reason."""
+
+
+class Case(object):
+    """One parametrized benchmark, identified by ``name[key=value,...]``."""
+
+    def __init__(self, name, **params):
+        self.name = name
+        self.params = params
+
+    @property
+    def id(self):
+        return "{0}[{1}]".format(
+            self.name, ",".join("{0}={1}".format(k, v) for k, v in self.params.items())
+        )
+
+    def result(self, timings, number, **extra):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "params": self.params,
+            "unit": "s/op",
+            "number": number,
+            "repeat": len(timings),
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "mean": statistics.mean(timings),
+            "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            "extra": extra,
+        }
+
+
+def _autorange(timer):
+    """
+    The number of operations whose timed loop lasts ``TARGET_TIME``, and
+    the time per operation of that first measure. ``timer(number)`` runs
+    ``number`` operations and returns the seconds they took.
+    """
+    number = 1
+    while True:
+        elapsed = timer(number)
+        if elapsed >= TARGET_TIME:
+            return number, elapsed / number
+        number *= max(2, int(TARGET_TIME / max(elapsed, 1e-9) * 1.2))
+
+
+def measure(timer, repeat=REPEAT):
+    """Times ``timer`` ``repeat`` times, returns the seconds per operation."""
+    number, first = _autorange(timer)
+    if first * number > TARGET_TIME * 10:
+        # a single operation is way over budget, one more run is enough
+        repeat = min(repeat, 2)
+    timings = [first]
+    gc.collect()
+    for _ in range(repeat - 1):
+        timings.append(timer(number) / number)
+    return timings, number
+
+
+def _loop_timer(func, *args):
+    def timer(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        return time.perf_counter() - start
+
+    return timer
+
+
+def _run_async(lib, func):
+    """Runs ``func`` under ``lib`` in a new thread, multio being per thread."""
+    outcome = []
+
+    async def main():
+        # multio.run does not hand back the return value
+        outcome.append((True, await func()))
+
+    def worker():
+        try:
+            multio.init(lib)
+            multio.run(main)
+        except BaseException as e:
+            outcome.append((False, e))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return value
+
+
+# find_match
+
+
+def _route(kind, i):
+    if kind == "string":
+        return "http://example.com/r/{0}".format(i), {}
+    if kind == "regex":
+        return re.compile(r"http://example\.com/r/{0}(/\w+)?$".format(i)), {}
+    if kind == "querystring":
+        url = "http://example.com/r?i={0}&x=1".format(i)
+        return url, {"match_querystring": True}
+    if kind == "unicode":
+        return "http://例え.jp/パス/{0}".format(i), {}
+    raise ValueError(kind)
+
+
+def _request_url(kind, i):
+    if kind == "querystring":
+        # same query string, other parameter order
+        return "http://example.com/r?x=1&i={0}".format(i)
+    if kind == "unicode":
+        return "http://例え.jp/パス/{0}".format(i)
+    return "http://example.com/r/{0}".format(i)
+
+
+def bench_find_match(case, routes, kind, lookup):
+    mock = replies.AsksMock(assert_all_requests_are_fired=False)
+    start = time.perf_counter()
+    for i in range(routes):
+        url, kwargs = _route(kind, i)
+        mock.add(replies.GET, url, **kwargs)
+    add = (time.perf_counter() - start) / routes
+
+    target = {"first": 0, "last": routes - 1}.get(lookup, routes)
+    request = Request("GET", _request_url(kind, target))
+    # the first lookup builds the indexes left for later
+    start = time.perf_counter()
+    found = mock._find_match(request)
+    first = time.perf_counter() - start
+    assert (found is None) == lookup.endswith("miss"), case.id
+
+    def find(request):
+        # forget the miss each time, ``cached_miss`` times the cache hits
+        if lookup == "miss":
+            mock._matches._misses.clear()
+        return mock._find_match(request)
+
+    timings, number = measure(_loop_timer(find, request))
+    return case.result(timings, number, add_per_route=add, first_lookup=first)
+
+
+def find_match_cases(quick):
+    sizes = (10, 1000) if quick else (10, 1000, 100000)
+    for kind in ("string", "regex", "querystring", "unicode"):
+        for routes in sizes:
+            for lookup in ("first", "last", "miss", "cached_miss"):
+                yield Case("find_match", routes=routes, kind=kind, lookup=lookup)
+
+
+def bench_regex_lookup(case, impl, routes, lookup):
+    """The regex routes matching an url, through ``RegexIndex`` or a loop."""
+    table = [
+        Route(i, replies.Reply(replies.GET, _route("regex", i)[0]), None)
+        for i in range(routes)
+    ]
+    url = _request_url("regex", routes - 1 if lookup == "hit" else routes)
+    if impl == "index":
+        match = RegexIndex(table).match
+    else:
+
+        def match(url):
+            return [route for route in table if route.reply.url.match(url)]
+
+    assert len(match(url)) == (lookup == "hit"), case.id
+    timings, number = measure(_loop_timer(match, url))
+    return case.result(timings, number)
+
+
+def regex_lookup_cases(quick):
+    sizes = (10, 100, 1000) if quick else (10, 100, 1000, 100000)
+    for routes in sizes:
+        for lookup in ("hit", "miss"):
+            for impl in ("index", "loop"):
+                yield Case("regex_lookup", impl=impl, routes=routes, lookup=lookup)
+
+
+# response bodies
+
+
+def bench_body(case, size, stream):
+    url = "http://example.com/body"
+    body = b"x" * size
+
+    async def timed(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            response = await asks.get(url, stream=stream)
+            if stream:
+                async with response.body as chunks:
+                    async for _ in chunks:
+                        pass
+        return time.perf_counter() - start
+
+    with replies.AsksMock(assert_all_requests_are_fired=False) as mock:
+        mock.add(replies.GET, url, body=body)
+        timings, number = measure(lambda number: _run_async("trio", lambda: timed(number)))
+    return case.result(
+        timings, number, throughput=size / statistics.median(timings)
+    )
+
+
+def body_cases(quick):
+    sizes = (KB, 64 * KB, MB) if quick else (KB, 64 * KB, MB, 16 * MB, 100 * MB)
+    for size in sizes:
+        for stream in (False, True):
+            yield Case("body", size=size, stream=stream)
+
+
+# call list growth
+
+
+def bench_calls(case, store, calls):
+    response = _run_async(
+        "trio",
+        lambda: ResponseTemplate(200, {}).build(Request("GET", "http://a/"), BodyReader(b"ok")),
+    )
+    requests = [
+        Request("GET", "http://example.com/{0}".format(i % 1000)) for i in range(calls)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def make():
+            if store == "journal":
+                return replies.CallList(
+                    store=replies.JournalStore(os.path.join(tmp, "calls.jsonl"))
+                )
+            return replies.CallList(store=store)
+
+        def timer(number):
+            elapsed = 0.0
+            for _ in range(number):
+                call_list = make()
+                start = time.perf_counter()
+                for request in requests:
+                    call_list.add(request, response, elapsed=0.001)
+                elapsed += time.perf_counter() - start
+                if store == "journal":
+                    call_list.store.close()
+            return elapsed
+
+        timings, number = measure(timer, repeat=3)
+
+        # memory is measured apart, tracing slows the appends down
+        call_list = make()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for request in requests:
+            call_list.add(request, response, elapsed=0.001)
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        if store == "journal":
+            call_list.store.close()
+
+    # per call, the requests themselves are not counted
+    timings = [t / calls for t in timings]
+    return case.result(timings, number, bytes_per_call=retained / calls)
+
+
+def calls_cases(quick):
+    sizes = (10000,) if quick else (10000, 100000, 1000000)
+    for store in ("calls", "fingerprints", "counters", "columns", "journal"):
+        for calls in sizes:
+            yield Case("calls", store=store, calls=calls)
+
+
+# concurrent storms
+
+
+def bench_storm(case, lib, tasks, latency):
+    if importlib.util.find_spec(lib) is None:
+        raise SkipCase("{0} is not installed".format(lib))
+    url = "http://example.com/storm"
+
+    async def fetch():
+        await asks.get(url)
+
+    async def storm(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            async with multio.asynclib.task_manager() as tm:
+                for _ in range(tasks):
+                    await multio.asynclib.spawn(tm, fetch)
+        return time.perf_counter() - start
+
+    with replies.AsksMock(assert_all_requests_are_fired=False) as mock:
+        mock.add(replies.GET, url, body="ok", latency=latency or None)
+        timings, number = measure(
+            lambda number: _run_async(lib, lambda: storm(number)), repeat=3
+        )
+    return case.result(
+        timings, number, requests_per_second=tasks / statistics.median(timings)
+    )
+
+
+def storm_cases(quick):
+    sizes = (100,) if quick else (100, 1000, 10000)
+    for lib in ("trio", "curio"):
+        for tasks in sizes:
+            for latency in (0, 0.01):
+                yield Case("storm", lib=lib, tasks=tasks, latency=latency)
+
+
+BENCHMARKS = [
+    (find_match_cases, bench_find_match),
+    (regex_lookup_cases, bench_regex_lookup),
+    (body_cases, bench_body),
+    (calls_cases, bench_calls),
+    (storm_cases, bench_storm),
+]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(quick=False, keywords=(), log=sys.stderr):
+    results = []
+    skipped = {}
+    for cases, bench in BENCHMARKS:
+        for case in cases(quick):
+            if keywords and not any(k in case.id for k in keywords):
+                continue
+            try:
+                result = bench(case, **case.params)
+            except SkipCase as e:
+                skipped[case.id] = str(e)
+                print("{0:<60} skipped: {1}".format(case.id, e), file=log)
+                continue
+            results.append(result)
+            print(
+                "{0:<60} {1:>12.3e} s/op".format(result["id"], result["median"]),
+                file=log,
+            )
+    return {
+        "format": FORMAT_VERSION,
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "quick": quick,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+def compare(baseline, report, threshold):
+    """Prints the median ratios to ``baseline``, returns the regressed ids."""
+    before = {result["id"]: result for result in baseline["results"]}
+    regressed = []
+    print("{0:<60} {1:>12} {2:>12} {3:>8}".format("case", "baseline", "current", "ratio"))
+    for result in report["results"]:
+        old = before.get(result["id"])
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("inf")
+        if ratio > threshold:
+            regressed.append(result["id"])
+        print(
+            "{0:<60} {1:>12.3e} {2:>12.3e} {3:>7.2f}x{4}".format(
+                result["id"],
+                old["median"],
+                result["median"],
+                ratio,
+                "  SLOWER" if ratio > threshold else "",
+            )
+        )
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-o", "--output", help="json file to write the results to")
+    parser.add_argument("-k", dest="keywords", action="append", default=[],
+                        help="only run the cases whose id contains this")
+    parser.add_argument("--quick", action="store_true", help="skip the largest cases")
+    parser.add_argument("--compare", help="json results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    report = run(quick=args.quick, keywords=args.keywords)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
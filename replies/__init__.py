@@ -1,14 +1,88 @@
-from .mock import AsksMock
-from .reply import CallbackReply, Reply
+"""
+Importing replies is cheap: asks, the reply classes and the default mock
+are only imported or built the first time one of their names is used,
+so code that only sometimes mocks does not pay for them up front.
+"""
+import importlib
+import sys
+import threading
+import types
 
-# useful for tests
-from .reply import BaseReply, std_mock
+__version__ = "0.1.1"
 
+# where each exported name lives, imported on first use
+_EXPORTS = {
+    "CallbackReply": ".reply",
+    "Reply": ".reply",
+    "SequenceReply": ".reply",
+    "AsksMock": ".mock",
+    "CallList": "._calls",
+    "ColumnStore": "._calls",
+    "Fingerprint": "._calls",
+    "JournalEntry": "._calls",
+    "JournalStore": "._calls",
+    "read_journal": "._calls",
+    "set_json_codec": "._utils",
+    # useful for tests
+    "BaseReply": ".reply",
+}
 
-# expose default mock namespace
-mock = _default_mock = AsksMock(assert_all_requests_are_fired=False)
-__all__ = ["CallbackReply", "Reply", "AsksMock"]
-for __attr in (a for a in dir(_default_mock) if not a.startswith("_")):
-    __all__.append(__attr)
-    globals()[__attr] = getattr(_default_mock, __attr)
+_SUBMODULES = ("latency",)
 
+_lock = threading.RLock()
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # importing the ``mock`` submodule binds it on the package, where
+        # ``mock`` is the default mock
+        if name == "mock" and isinstance(value, types.ModuleType):
+            value = globals().get("_default_mock")
+            if value is None:
+                globals().pop("mock", None)
+                return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+
+def _import(module):
+    return importlib.import_module(module, __name__)
+
+
+def _get_default_mock():
+    with _lock:
+        if "_default_mock" not in globals():
+            default = _import(".mock").AsksMock(assert_all_requests_are_fired=False)
+            globals()["mock"] = globals()["_default_mock"] = default
+        return globals()["_default_mock"]
+
+
+def _default_names():
+    return [a for a in dir(_get_default_mock()) if not a.startswith("_")]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(_import(_EXPORTS[name]), name)
+    elif name in _SUBMODULES:
+        value = _import("." + name)
+    elif name == "std_mock":
+        from unittest import mock as value
+    elif name in ("mock", "_default_mock"):
+        return _get_default_mock()
+    elif name == "__all__":
+        value = list(_EXPORTS) + _default_names()
+        value.remove("BaseReply")
+    elif not name.startswith("_") and name in _default_names():
+        # expose default mock namespace
+        value = getattr(_get_default_mock(), name)
+    else:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(_SUBMODULES) | {"std_mock"})
@@ -0,0 +1,267 @@
+"""
+The asks side of replies: what an intercepted ``Session.request`` call looks
+like to the replies, and the asks response objects they are turned into.
+"""
+import inspect
+import json as json_module
+
+from functools import partialmethod
+from urllib.parse import urljoin, urlsplit
+
+from http import HTTPStatus
+
+from asks.errors import RequestTimeout
+from asks.request_object import RequestProcessor
+from asks.req_structs import CaseInsensitiveDict
+from asks.response_objects import Cookie, Response, StreamResponse
+from asks.sessions import BaseSession, Session
+
+from ._utils import ChunkedBody, _ensure_url_default_path, _json_loads, _maybe_await
+
+
+# the original request coroutine, used to passthru requests to the network
+_real_request = BaseSession.request
+
+# asks' http method helpers are partialmethods bound to the original
+# ``request`` at class creation, so they have to be patched alongside it.
+SESSION_METHODS = tuple(
+    name
+    for name in ("get", "head", "post", "put", "delete", "options", "patch")
+    if isinstance(BaseSession.__dict__.get(name), partialmethod)
+)
+
+REASON_PHRASES = {status.value: status.phrase for status in HTTPStatus}
+
+# asks 3 builds the url from the path in ``Session._make_url(path)``,
+# asks 2 returns the base url and leaves the path to be appended.
+_MAKE_URL_TAKES_PATH = len(inspect.signature(Session._make_url).parameters) > 1
+
+# how many bytes asks reads from its socket at a time
+CHUNK_SIZE = 10000
+
+
+class Request(object):
+    """
+    An intercepted asks request, as seen by replies and callbacks.
+
+    ``kwargs`` are the remaining keyword arguments of the ``request`` call,
+    used to send the request for real when it is passed thru.
+    """
+
+    def __init__(self, method, url, headers=None, body=None, encoding="utf-8", **kwargs):
+        self.method = method.upper()
+        self.url = url
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.body = body
+        self.encoding = encoding
+        self.stream = kwargs.get("stream") or False
+        self.timeout = kwargs.get("timeout")
+        self.follow_redirects = kwargs.get("follow_redirects", True)
+        self.max_redirects = kwargs.get("max_redirects", 20)
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return "<Request {0} {1}>".format(self.method, self.url)
+
+    def json(self):
+        """Decodes the json body of the request."""
+        return _json_loads(self.body)
+
+    @classmethod
+    def from_session(cls, session, method, url=None, path="", **kwargs):
+        """
+        Builds the request ``session.request(method, url, **kwargs)`` would
+        send, the same way asks composes url, query string and body.
+        """
+        if url is None:
+            if _MAKE_URL_TAKES_PATH:
+                url = session._make_url(path)
+            else:
+                url = session._make_url() + path
+        url = _ensure_url_default_path(url)
+
+        params = kwargs.pop("params", None)
+        if params:
+            if isinstance(params, dict):
+                url += RequestProcessor._dict_to_query(params, base_query="?" in url)
+            else:
+                url += ("&" if "?" in url else "?") + params.lstrip("?&")
+
+        headers = CaseInsensitiveDict(session.headers or {})
+        headers.update(kwargs.pop("headers", None) or {})
+        encoding = kwargs.pop("encoding", None) or getattr(session, "encoding", None) or "utf-8"
+
+        body = None
+        if kwargs.get("data") is not None:
+            data = kwargs["data"]
+            if isinstance(data, dict):
+                body = RequestProcessor._dict_to_query(data, params=False)
+                headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+            else:
+                body = data
+        elif kwargs.get("json") is not None:
+            body = json_module.dumps(kwargs["json"])
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(body, str):
+            body = body.encode(encoding)
+
+        return cls(method, url, headers=headers, body=body, encoding=encoding, **kwargs)
+
+    def redirect(self, response):
+        """
+        Returns the request following the redirect ``response``. Like asks,
+        only 301 and 305 keep the method, other redirects switch to GET.
+        """
+        url = urljoin(self.url, response.headers["location"].strip())
+        kwargs = dict(self.kwargs)
+        if response.status_code in (301, 305):
+            method, body = self.method, self.body
+        else:
+            method, body = "GET", None
+            for key in ("data", "json", "files", "multipart"):
+                kwargs.pop(key, None)
+        return Request(
+            method, url, headers=self.headers, body=body, encoding=self.encoding, **kwargs
+        )
+
+
+class StreamBody(object):
+    """
+    Stands in for asks' ``StreamBody``: iterates over a reply body in
+    socket sized chunks, or in the chunks of a lazy ``ChunkedBody``.
+    """
+
+    def __init__(self, body, chunk_size=CHUNK_SIZE):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.timeout = None
+        self.bandwidth = None
+        self.clock = None
+
+    def shape(self, bandwidth, clock):
+        """Paces the chunks to ``bandwidth``, timed on ``clock``."""
+        self.bandwidth = bandwidth
+        self.clock = clock
+        if bandwidth.chunk_size:
+            self.chunk_size = bandwidth.chunk_size
+
+    def __aiter__(self):
+        if self.bandwidth is None:
+            return self._chunks()
+        return self._shaped_chunks()
+
+    async def _shaped_chunks(self):
+        # deadlines are computed from the start so sleeps do not drift
+        start = self.clock.now()
+        received = 0
+        async for chunk in self._chunks():
+            received += len(chunk)
+            wait = start + self.bandwidth.transfer_time(received) - self.clock.now()
+            if self.timeout is not None and wait > self.timeout:
+                await self.clock.sleep(self.timeout)
+                raise RequestTimeout(
+                    "Timed out after {0}s reading the body".format(self.timeout)
+                )
+            await self.clock.sleep(wait)
+            yield chunk
+
+    async def _chunks(self):
+        if isinstance(self.body, ChunkedBody):
+            async for chunk in self.body:
+                yield chunk
+            return
+        while True:
+            chunk = self.body.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def __call__(self, timeout=None):
+        self.timeout = timeout
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def close(self):
+        await _maybe_await(self.body.close())
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class ResponseTemplate(object):
+    """
+    The status line, headers and cookies of a frozen reply, computed once.
+
+    Every response gets a shallow copy of its headers and cookies, so
+    callers changing a response do not change the next ones.
+    """
+
+    def __init__(self, status, headers):
+        self.status = status
+        self.reason_phrase = REASON_PHRASES.get(status)
+        self.headers = CaseInsensitiveDict(headers)
+        self._chunked_headers = None
+        set_cookie = self.headers.get("set-cookie")
+        self._cookies = _parse_cookies(set_cookie) if set_cookie else None
+        self._host_cookies = {}
+
+    def cookies(self, url):
+        """The asks cookies of a response to ``url``, built once per host."""
+        if self._cookies is None:
+            return []
+        host = urlsplit(url).netloc
+        try:
+            return self._host_cookies[host]
+        except KeyError:
+            cookies = self._host_cookies[host] = build_cookies(host, self._cookies)
+            return cookies
+
+    async def build(self, request, body, stream=False):
+        """Returns the asks response to ``request``, with ``body`` as body."""
+        headers = self.headers
+        if isinstance(body, ChunkedBody):
+            if self._chunked_headers is None:
+                self._chunked_headers = CaseInsensitiveDict(headers)
+                self._chunked_headers["Transfer-Encoding"] = "chunked"
+            headers = self._chunked_headers
+        kwargs = dict(
+            encoding=request.encoding,
+            http_version="1.1",
+            status_code=self.status,
+            reason_phrase=self.reason_phrase,
+            headers=CaseInsensitiveDict(headers),
+            method=request.method,
+            url=request.url,
+        )
+        if stream or request.stream:
+            response = StreamResponse(body=StreamBody(body), **kwargs)
+        else:
+            response = Response(body=await _maybe_await(body.read()), **kwargs)
+        response.cookies = list(self.cookies(request.url))
+        return response
+
+
+def _parse_cookies(set_cookie):
+    # cookies is only imported by the replies setting some
+    from cookies import Cookies
+
+    return Cookies.from_request(set_cookie)
+
+
+async def build_response(request, status, headers, body, stream=False):
+    """
+    Returns the asks response of a reply. ``body`` is a file-like object or
+    a ``ChunkedBody``, read at once unless the reply or the request asked
+    for streaming.
+    """
+    return await ResponseTemplate(status, headers).build(request, body, stream=stream)
+
+
+def build_cookies(host, cookies):
+    """Turns parsed ``cookies.Cookies`` into asks' response cookies."""
+    return [
+        Cookie(host, {"name": cookie.name, "value": cookie.value})
+        for cookie in cookies.values()
+    ]
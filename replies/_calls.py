@@ -0,0 +1,414 @@
+"""
+The call log of an ``AsksMock``, with retention policies for long runs.
+
+A ``CallList`` counts every call and hands the ones it keeps to a store:
+a list of calls or fingerprints, nothing at all, a journal on disk or
+columns of compact rows.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from array import array
+from collections import Counter, deque, namedtuple
+from collections.abc import Sequence, Sized
+from itertools import compress
+from operator import and_
+from urllib.parse import urlsplit
+
+from ._utils import Call
+
+
+# a compact record of a call, kept instead of the request and response
+Fingerprint = namedtuple("Fingerprint", ["method", "url", "status", "body_digest"])
+
+# a call read back from a column store
+Row = namedtuple("Row", ["time", "method", "url", "host", "status", "size", "elapsed"])
+
+# a call read back from a journal, ``time`` is when it was recorded
+JournalEntry = namedtuple(
+    "JournalEntry",
+    ["time", "method", "url", "headers", "body_digest", "status", "elapsed"],
+)
+
+
+def _status(response):
+    """The status code of a response, or the class name of an error."""
+    try:
+        return response.status_code
+    except AttributeError:
+        return type(response).__name__
+
+
+def _digest(body):
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    elif not isinstance(body, (bytes, bytearray, memoryview)):
+        body = repr(body).encode("utf-8")
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+
+def fingerprint(request, response):
+    return Fingerprint(
+        request.method, request.url, _status(response), _digest(request.body)
+    )
+
+
+class ListStore(object):
+    """Keeps calls, or their fingerprints, in memory."""
+
+    def __init__(self, maxlen=None, fingerprints=False):
+        self.maxlen = maxlen
+        self.fingerprints = fingerprints
+        self.clear()
+
+    def append(self, request, response, elapsed=None):
+        if self.fingerprints:
+            self._calls.append(fingerprint(request, response))
+        else:
+            self._calls.append(Call(request, response))
+
+    def __iter__(self):
+        return iter(self._calls)
+
+    def __len__(self):
+        return len(self._calls)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice) and self.maxlen is not None:
+            return list(self._calls)[idx]
+        return self._calls[idx]
+
+    def clear(self):
+        self._calls = [] if self.maxlen is None else deque(maxlen=self.maxlen)
+
+
+class NullStore(object):
+    """Keeps no call."""
+
+    def append(self, request, response, elapsed=None):
+        pass
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+    def __getitem__(self, idx):
+        return [][idx]
+
+    def clear(self):
+        pass
+
+
+class JournalStore(object):
+    """
+    Appends every call to ``path``, one json line per call, and reads them
+    back lazily as ``JournalEntry`` tuples. Only the offset of each line is
+    kept in memory. ``headers`` are the request headers worth recording.
+
+    The file is never truncated: clearing the store only forgets the calls
+    recorded so far, later calls keep being appended after them.
+    """
+
+    def __init__(self, path, headers=()):
+        self.path = os.fspath(path)
+        self.headers = tuple(headers)
+        self._file = open(self.path, "ab")
+        self.clear()
+
+    def append(self, request, response, elapsed=None):
+        entry = [
+            time.time(),
+            request.method,
+            request.url,
+            {
+                name: request.headers[name]
+                for name in self.headers
+                if name in request.headers
+            },
+            _digest(request.body),
+            _status(response),
+            elapsed,
+        ]
+        self._offsets.append(self._file.tell())
+        self._file.write(json.dumps(entry, separators=(",", ":")).encode("utf-8"))
+        self._file.write(b"\n")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        if not self._offsets:
+            return iter(())
+        self._file.flush()
+        return read_journal(self.path, start=self._offsets[0], count=len(self))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        offset = self._offsets[idx]
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return JournalEntry(*json.loads(f.readline()))
+
+    def clear(self):
+        self._offsets = array("Q")
+
+    def close(self):
+        self._file.close()
+
+
+def read_journal(path, start=0, count=None):
+    """Iterates over the ``JournalEntry`` of a journal file."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        for n, line in enumerate(f):
+            if count is not None and n >= count:
+                break
+            yield JournalEntry(*json.loads(line))
+
+
+def _size(response):
+    """The body size of a response, -1 for errors and streams."""
+    body = getattr(response, "body", None)
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return len(body)
+    return -1
+
+
+def _percentile(values, q):
+    # linear interpolation between the closest ranks of sorted ``values``
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100.0
+    lo, hi = int(math.floor(rank)), int(math.ceil(rank))
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+
+class ColumnStore(object):
+    """
+    Keeps calls as typed array columns, a few bytes per call, and answers
+    aggregate queries over them.
+
+    ``method``, ``url`` and ``host`` are interned, ``status`` is the status
+    code or the class name of an error, ``size`` the response body size (-1
+    for errors and streams), ``time`` the recording time and ``elapsed`` the
+    time the mock took to answer.
+
+    Queries filter on keyword arguments, each a value or a container of
+    values, such as ``status=range(500, 600)``:
+
+    >>> calls.store.count(url='http://example.com/', status=range(500, 600))
+    >>> calls.store.percentile('elapsed', 99, by='host')
+    """
+
+    INTERNED = ("method", "url", "host")
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._columns = {
+            "time": array("d"),
+            "method": array("L"),
+            "url": array("L"),
+            "host": array("L"),
+            "status": array("l"),
+            "size": array("q"),
+            "elapsed": array("d"),
+        }
+        self._ids = {name: {} for name in self.INTERNED + ("status",)}
+        self._values = {name: [] for name in self.INTERNED + ("status",)}
+        # the host id of every url id
+        self._url_hosts = []
+
+    def _intern(self, name, value):
+        ids = self._ids[name]
+        try:
+            return ids[value]
+        except KeyError:
+            ids[value] = len(ids)
+            self._values[name].append(value)
+            return ids[value]
+
+    def _encode_status(self, status):
+        # errors are stored as negative ids, status codes as themselves
+        if isinstance(status, int):
+            return status
+        return -1 - self._intern("status", status)
+
+    def _decode(self, name, value):
+        if name in self.INTERNED:
+            return self._values[name][value]
+        if name == "status" and value < 0:
+            return self._values["status"][-1 - value]
+        return value
+
+    def append(self, request, response, elapsed=None):
+        columns = self._columns
+        columns["time"].append(time.time())
+        columns["method"].append(self._intern("method", request.method))
+        url = self._intern("url", request.url)
+        if url == len(self._url_hosts):
+            self._url_hosts.append(self._intern("host", urlsplit(request.url).netloc))
+        columns["url"].append(url)
+        columns["host"].append(self._url_hosts[url])
+        columns["status"].append(self._encode_status(_status(response)))
+        columns["size"].append(_size(response))
+        columns["elapsed"].append(elapsed if elapsed is not None else math.nan)
+
+    def __len__(self):
+        return len(self._columns["time"])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return Row(
+            *(self._decode(name, self._columns[name][idx]) for name in Row._fields)
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def column(self, name):
+        """The decoded values of a column, oldest call first."""
+        if name in self.INTERNED or name == "status":
+            return [self._decode(name, value) for value in self._columns[name]]
+        return self._columns[name]
+
+    def _wanted(self, name, value):
+        if isinstance(value, (str, int, float)) or value is None:
+            value = (value,)
+        if name in self.INTERNED:
+            ids = self._ids[name]
+            return {ids[v] for v in value if v in ids}
+        if name == "status":
+            if isinstance(value, range):
+                return value
+            errors = self._ids["status"]
+            return {
+                v if isinstance(v, int) else -1 - errors[v]
+                for v in value
+                if isinstance(v, int) or v in errors
+            }
+        return set(value)
+
+    def _mask(self, filters):
+        # a list of booleans selecting the rows matching every filter
+        mask = None
+        for name, value in filters.items():
+            wanted = self._wanted(name, value)
+            rows = list(map(wanted.__contains__, self._columns[name]))
+            mask = rows if mask is None else list(map(and_, mask, rows))
+        return mask
+
+    def _select(self, name, mask):
+        column = self._columns[name]
+        return column if mask is None else compress(column, mask)
+
+    def count(self, **filters):
+        """The number of calls matching ``filters``."""
+        mask = self._mask(filters)
+        return len(self) if mask is None else sum(mask)
+
+    def group_count(self, by, **filters):
+        """Counts the calls matching ``filters`` per value of column ``by``."""
+        counts = Counter(self._select(by, self._mask(filters)))
+        return Counter({self._decode(by, key): n for key, n in counts.items()})
+
+    def percentile(self, column, q, by=None, **filters):
+        """
+        The ``q`` percentile of ``column`` over the calls matching
+        ``filters``, or a dict of them per value of column ``by``.
+        """
+        mask = self._mask(filters)
+        values = self._select(column, mask)
+        if by is None:
+            return _percentile(list(values), q)
+        groups = {}
+        for key, value in zip(self._select(by, mask), values):
+            groups.setdefault(key, []).append(value)
+        return {
+            self._decode(by, key): _percentile(group, q)
+            for key, group in groups.items()
+        }
+
+
+class CallList(Sequence, Sized):
+    """
+    The calls made to a mock, oldest first.
+
+    By default every ``Call(request, response)`` is kept. For long runs:
+
+    - ``maxlen`` only keeps the last ``maxlen`` calls, or fingerprints,
+    - ``sample`` only keeps one call in ``sample``, the first one included,
+    - ``store="fingerprints"`` keeps a ``Fingerprint`` instead of the
+      request and response objects,
+    - ``store="counters"`` keeps no call at all,
+    - ``store="columns"`` keeps a ``ColumnStore`` of compact rows,
+    - ``store=JournalStore(path)`` writes the calls to disk.
+
+    ``len()`` and indexing only cover the calls kept. Every call, kept or
+    not, is counted in ``total`` and per ``(method, status)`` in
+    ``counters``, the status being the class name of errors. Calls can be
+    added from several threads.
+    """
+
+    def __init__(self, maxlen=None, sample=1, store="calls"):
+        self._lock = threading.Lock()
+        self.configure(maxlen=maxlen, sample=sample, store=store)
+
+    def configure(self, maxlen=None, sample=1, store="calls"):
+        """Changes the retention policy, forgetting the calls made so far."""
+        if sample < 1:
+            raise ValueError("sample must be at least 1, not {0!r}".format(sample))
+        if maxlen is not None and store not in ("calls", "fingerprints"):
+            raise ValueError(
+                "maxlen only applies to the calls and fingerprints stores, "
+                "not {0!r}".format(store)
+            )
+        if store == "calls":
+            store = ListStore(maxlen)
+        elif store == "fingerprints":
+            store = ListStore(maxlen, fingerprints=True)
+        elif store == "counters":
+            store = NullStore()
+        elif store == "columns":
+            store = ColumnStore()
+        elif isinstance(store, str):
+            raise ValueError("Unknown call store {0!r}".format(store))
+        self.maxlen = maxlen
+        self.sample = sample
+        self.store = store
+        self.reset()
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, idx):
+        return self.store[idx]
+
+    def add(self, request, response, elapsed=None):
+        with self._lock:
+            self.total += 1
+            self.counters[request.method, _status(response)] += 1
+            if (self.total - 1) % self.sample == 0:
+                self.store.append(request, response, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.store.clear()
+            self.total = 0
+            self.counters = Counter()
@@ -0,0 +1,166 @@
+"""
+Cassettes: responses recorded from the network, replayed from disk.
+
+A cassette file is the ``MAGIC`` header, then one record per interaction,
+then an index and a trailer::
+
+    record   <I meta size> <json meta> <body>
+    index    <Q key> <Q record offset>, sorted by key, then by offset
+    trailer  <Q index offset> <Q count> MAGIC
+
+Keys are 64 bits fingerprints of the request method, url and body. Replay
+memory-maps the file and binary searches the index, so opening a cassette
+only reads its trailer and bodies are only read when served.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+from array import array
+
+from ._asks import ResponseTemplate
+from ._utils import BodyReader
+
+
+MAGIC = b"RPLCAS01"
+
+_META = struct.Struct("<I")
+_ENTRY = struct.Struct("<QQ")
+_TRAILER = struct.Struct("<QQ8s")
+
+
+def _key(method, url, body):
+    h = hashlib.blake2b(digest_size=8)
+    h.update(method.upper().encode("utf-8"))
+    h.update(b"\0")
+    h.update(url.encode("utf-8"))
+    h.update(b"\0")
+    if body is not None:
+        h.update(body if isinstance(body, bytes) else str(body).encode("utf-8"))
+    return int.from_bytes(h.digest(), "little")
+
+
+def _headers(headers):
+    return {
+        str(name): value if isinstance(value, (str, list)) else str(value)
+        for name, value in dict(headers).items()
+    }
+
+
+class CassetteWriter(object):
+    """Appends interactions to a new cassette, the index is written on close."""
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._file = open(self.path, "wb")
+        self._file.write(MAGIC)
+        self._keys = array("Q")
+        self._offsets = array("Q")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, request, response):
+        """Records ``response``, which must have been read whole."""
+        body = bytes(response.body or b"")
+        meta = json.dumps(
+            {
+                "method": request.method,
+                "url": request.url,
+                "status": response.status_code,
+                "headers": _headers(response.headers),
+                "size": len(body),
+            },
+            separators=(",", ":"),
+        ).encode("utf-8")
+        key = _key(request.method, request.url, request.body)
+        with self._lock:
+            self._keys.append(key)
+            self._offsets.append(self._file.tell())
+            self._file.write(_META.pack(len(meta)))
+            self._file.write(meta)
+            self._file.write(body)
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            index_offset = self._file.tell()
+            for key, offset in sorted(zip(self._keys, self._offsets)):
+                self._file.write(_ENTRY.pack(key, offset))
+            self._file.write(_TRAILER.pack(index_offset, len(self._keys), MAGIC))
+            self._file.close()
+
+
+class Cassette(object):
+    """
+    A recorded cassette, memory-mapped. Requests recorded several times get
+    their responses in recorded order, then the last one again.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._map)
+        if size < len(MAGIC) + _TRAILER.size or self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a replies cassette".format(self.path))
+        self._index, self._count, magic = _TRAILER.unpack_from(
+            self._map, size - _TRAILER.size
+        )
+        if magic != MAGIC:
+            raise ValueError("{0} is not a complete cassette".format(self.path))
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._map, self._index + i * _ENTRY.size)
+
+    def _first(self, key):
+        # leftmost index entry with ``key``, binary searched in the mapping
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, request):
+        """The offset of the record answering ``request``, or None."""
+        key = _key(request.method, request.url, request.body)
+        first = self._first(key)
+        if first == self._count or self._entry(first)[0] != key:
+            return None
+        with self._lock:
+            served = self._served.get(key, 0)
+            i = first + served
+            if i < self._count and self._entry(i)[0] == key:
+                self._served[key] = served + 1
+            else:
+                i -= 1
+        return self._entry(i)[1]
+
+    async def get_response(self, request, offset):
+        (meta_size,) = _META.unpack_from(self._map, offset)
+        start = offset + _META.size
+        meta = json.loads(self._map[start:start + meta_size].decode("utf-8"))
+        start += meta_size
+        body = memoryview(self._map)[start:start + meta["size"]]
+        template = ResponseTemplate(meta["status"], meta["headers"])
+        return await template.build(request, BodyReader(body))
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            # bodies still being read keep the mapping alive
+            pass
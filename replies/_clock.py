@@ -0,0 +1,180 @@
+import heapq
+import importlib
+import itertools
+import time
+
+import sniffio
+
+from ._utils import _maybe_await
+
+
+def _asynclib():
+    """The module of the async library running the current task."""
+    return importlib.import_module(sniffio.current_async_library())
+
+
+class RealClock(object):
+    def now(self):
+        return time.monotonic()
+
+    async def sleep(self, seconds):
+        await _asynclib().sleep(seconds)
+
+
+class TrioClock(object):
+    """Trio's own clock, virtual when trio runs with a ``MockClock``."""
+
+    def now(self):
+        import trio
+
+        return trio.current_time()
+
+    async def sleep(self, seconds):
+        import trio
+
+        await trio.sleep(seconds)
+
+
+class VirtualClock(object):
+    """
+    Virtual time for event loops without a mock clock.
+
+    Sleeping tasks queue up by deadline. Only the earliest one is awake: it
+    lets the other tasks run ``settle`` times, so they can queue up earlier
+    deadlines, then jumps the clock to its deadline and hands over to the
+    next sleeper. Delays keep their order but take no real time.
+    """
+
+    def __init__(self, start=0.0, settle=10):
+        self._now = start
+        self._sleepers = []
+        self._seq = itertools.count()
+        self.settle = settle
+
+    def now(self):
+        return self._now
+
+    async def _wake_head(self):
+        if self._sleepers:
+            await _maybe_await(self._sleepers[0][2].set())
+
+    async def sleep(self, seconds):
+        lib = _asynclib()
+        entry = [self._now + max(seconds, 0), next(self._seq), lib.Event()]
+        heapq.heappush(self._sleepers, entry)
+        try:
+            idle = 0
+            while idle < self.settle:
+                if self._sleepers[0] is not entry:
+                    idle = 0
+                    entry[2] = lib.Event()
+                    await entry[2].wait()
+                    continue
+                idle += 1
+                await lib.sleep(0)
+            self._now = max(self._now, entry[0])
+        finally:
+            if self._sleepers[0] is entry:
+                heapq.heappop(self._sleepers)
+            else:
+                self._sleepers.remove(entry)
+                heapq.heapify(self._sleepers)
+            # also when cancelled, or the next sleeper would wait forever
+            await self._wake_head()
+
+
+def _current_clock():
+    """The clock virtual time runs on in the current event loop."""
+    if sniffio.current_async_library() == "trio":
+        import trio
+        import trio.testing
+
+        lowlevel = getattr(trio, "lowlevel", None) or trio.hazmat
+        if isinstance(lowlevel.current_clock(), trio.testing.MockClock):
+            return TrioClock()
+    return VirtualClock()
+
+
+async def _within(clock, seconds, func, *args):
+    """
+    Awaits ``func(*args)``, cancelling it if ``seconds`` pass on ``clock``
+    first. Returns whether it finished, and its result.
+    """
+    within = {"trio": _trio_within, "curio": _curio_within}.get(
+        sniffio.current_async_library(), _asyncio_within
+    )
+    return await within(clock, seconds, func, args)
+
+
+async def _trio_within(clock, seconds, func, args):
+    import trio
+
+    outcome = []
+    async with trio.open_nursery() as nursery:
+
+        async def watchdog():
+            await clock.sleep(seconds)
+            nursery.cancel_scope.cancel()
+
+        nursery.start_soon(watchdog)
+        try:
+            outcome.append((True, await func(*args)))
+        except Exception as e:
+            # raised as is rather than grouped by the nursery
+            outcome.append((False, e))
+        nursery.cancel_scope.cancel()
+    return _unwrap(outcome)
+
+
+async def _curio_within(clock, seconds, func, args):
+    import curio
+
+    # curio cancels a task only once, so ``func`` gets a task of its own
+    done = curio.Event()
+    outcome = []
+
+    async def run():
+        try:
+            outcome.append((True, await func(*args)))
+        except curio.CancelledError:
+            raise
+        except Exception as e:
+            outcome.append((False, e))
+        await done.set()
+
+    async def watchdog():
+        await clock.sleep(seconds)
+        await done.set()
+
+    task = await curio.spawn(run, daemon=True)
+    guard = await curio.spawn(watchdog, daemon=True)
+    try:
+        await done.wait()
+    finally:
+        await guard.cancel()
+        await task.cancel()
+    return _unwrap(outcome)
+
+
+async def _asyncio_within(clock, seconds, func, args):
+    import asyncio
+
+    task = asyncio.ensure_future(func(*args))
+    guard = asyncio.ensure_future(clock.sleep(seconds))
+    try:
+        await asyncio.wait((task, guard), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        guard.cancel()
+        task.cancel()
+    if not task.done() or task.cancelled():
+        return False, None
+    return True, task.result()
+
+
+def _unwrap(outcome):
+    if not outcome:
+        return False, None
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return True, value
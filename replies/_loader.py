@@ -0,0 +1,151 @@
+"""
+Declarative replies: route specs read from JSON, YAML or TOML files.
+
+A spec file holds a list of replies, or a mapping with a ``replies`` list.
+Each reply is a mapping of ``Reply`` arguments, ``regex: true`` compiles
+its url as a regular expression::
+
+    replies:
+      - method: GET
+        url: http://example.com/api
+        json: {"ok": true}
+      - method: POST
+        url: http://example\\.com/items/\\d+
+        regex: true
+        status: 201
+
+The replies built from a file are pickled in a cache keyed by the hash of
+its content and the replies version, later loads of the same content only
+unpickle them. Unpickling runs code, so the cache only loads files from a
+directory and files owned by the current user and writable by no one else.
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import stat
+import tempfile
+
+from . import __version__
+from .reply import BaseReply, Reply
+
+
+# bump when the pickled replies change shape
+CACHE_VERSION = b"1"
+
+
+def _user_cache_dir():
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+    return os.path.join(base, "replies")
+
+
+DEFAULT_CACHE_DIR = _user_cache_dir()
+
+
+def _trusted(st):
+    """Whether the stat result ``st`` is of a file only we could have written."""
+    if not hasattr(os, "getuid"):
+        return True
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _parse_yaml(text):
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("Loading YAML replies requires PyYAML")
+    return yaml.safe_load(text)
+
+
+def _parse_toml(text):
+    try:
+        import tomllib as toml
+    except ImportError:
+        try:
+            import toml
+        except ImportError:
+            raise ImportError("Loading TOML replies requires toml")
+    return toml.loads(text)
+
+
+PARSERS = {
+    ".json": json.loads,
+    ".yaml": _parse_yaml,
+    ".yml": _parse_yaml,
+    ".toml": _parse_toml,
+}
+
+
+def reply_from_spec(spec):
+    """Builds the ``Reply`` described by the mapping ``spec``."""
+    if isinstance(spec, BaseReply):
+        return spec
+    spec = dict(spec)
+    if spec.pop("regex", False):
+        spec["url"] = re.compile(spec["url"])
+    if isinstance(spec.get("rate_limit"), list):
+        spec["rate_limit"] = tuple(spec["rate_limit"])
+    return Reply(**spec)
+
+
+def parse_specs(path, content):
+    """The reply specs of the file ``path``, whose bytes are ``content``."""
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        parser = PARSERS[ext]
+    except KeyError:
+        raise ValueError("Unsupported replies file {0!r}".format(path))
+    specs = parser(content.decode("utf-8"))
+    if isinstance(specs, dict):
+        specs = specs.get("replies", [])
+    return specs
+
+
+def load_replies(path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the replies of the spec file ``path``, from the cache in
+    ``cache_dir`` when the same content was loaded before. A ``cache_dir``
+    of None disables the cache.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    if cache_dir is None:
+        return [reply_from_spec(spec) for spec in parse_specs(path, content)]
+
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        cache_ok = _trusted(os.stat(cache_dir))
+    except OSError:
+        cache_ok = False
+    if not cache_ok:
+        return [reply_from_spec(spec) for spec in parse_specs(path, content)]
+
+    key = b"\0".join([CACHE_VERSION, __version__.encode("ascii"), content])
+    cache_path = os.path.join(cache_dir, hashlib.sha256(key).hexdigest() + ".pickle")
+    try:
+        with open(cache_path, "rb") as f:
+            if _trusted(os.fstat(f.fileno())):
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    replies = [reply_from_spec(spec) for spec in parse_specs(path, content)]
+    try:
+        data = pickle.dumps(replies, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # replies holding files or mappings are not cached
+        return replies
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return replies
@@ -0,0 +1,192 @@
+"""
+Passthru: the requests no reply matches that are sent to the network.
+"""
+import socket
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from asks import Session
+
+from ._asks import _real_request
+from ._utils import _upstream
+
+
+class PrefixIndex(object):
+    """
+    Url prefixes indexed by scheme and host, so matching an url only checks
+    the prefixes of its own upstream. Prefixes that stop before the end of
+    their host are checked one by one.
+    """
+
+    def __init__(self, prefixes=()):
+        self.prefixes = ()
+        self._upstreams = {}
+        self._partial = []
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        self.prefixes += (prefix,)
+        upstream = _upstream(prefix)
+        if upstream is None:
+            self._partial.append(prefix)
+        else:
+            self._upstreams.setdefault(upstream, []).append(prefix)
+
+    def match(self, url):
+        """Returns the first prefix of ``url``, or None."""
+        upstream = _upstream(url)
+        if upstream is not None:
+            for prefix in self._upstreams.get(upstream, ()):
+                if url.startswith(prefix):
+                    return prefix
+        for prefix in self._partial:
+            if url.startswith(prefix):
+                return prefix
+        return None
+
+
+class PassthruTiming(object):
+    """How many requests went to an upstream, and how long they took."""
+
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = elapsed if self.max is None else max(self.max, elapsed)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def __repr__(self):
+        return "<PassthruTiming count={0} mean={1}>".format(self.count, self.mean)
+
+
+# the attributes the connections asks pools keep what they wrap in: anyio
+# tls streams, trio streams and sockets, curio sockets, anyio socket streams
+_WRAPPED = ("transport_stream", "socket", "_sock", "_socket", "_trio_socket", "_raw_socket")
+
+
+def _unwrap(conn):
+    """The stream or socket ``conn`` wraps, or None."""
+    for name in _WRAPPED:
+        inner = getattr(conn, name, None)
+        if inner is not None:
+            return inner
+    extra = getattr(conn, "extra", None)
+    if extra is None:
+        return None
+    try:
+        from anyio.abc import SocketAttribute
+    except ImportError:
+        return None
+    return extra(SocketAttribute.raw_socket, None)
+
+
+def _close_connection(conn):
+    """
+    Closes a pooled connection without awaiting, as the loop that opened it
+    may be gone: through its asyncio transport, or else the standard socket
+    it wraps. Returns False when it cannot be unwrapped that far.
+    """
+    seen = set()
+    while conn is not None and id(conn) not in seen:
+        seen.add(id(conn))
+        if isinstance(conn, socket.socket):
+            conn.close()
+            return True
+        transport = getattr(conn, "_transport", None)
+        if transport is not None:
+            try:
+                transport.close()
+                return True
+            except RuntimeError:
+                # its loop is closed, the socket is closed directly
+                pass
+        conn = _unwrap(conn)
+    return False
+
+
+def _close_pool(session):
+    """Closes the pooled connections of an asks ``session``."""
+    pool = session._conn_pool
+    while pool:
+        _close_connection(pool.pop())
+
+
+class PassthruDispatcher(object):
+    """
+    Sends passthru requests through one pooled asks ``Session`` per thread
+    and upstream, holding at most ``connections`` connections each, and
+    times them per upstream in ``timings``.
+
+    Requests from sessions with their own ssl context or cookie tracking
+    keep going through their session. ``connections=None`` disables the
+    pool altogether.
+    """
+
+    def __init__(self, prefixes=(), connections=10):
+        self.index = PrefixIndex(prefixes)
+        self.connections = connections
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Closes the pooled sessions and drops them and the timings."""
+        with self._lock:
+            sessions = getattr(self, "_sessions", {})
+            self._sessions = {}
+            self.timings = {}
+        for session in sessions.values():
+            _close_pool(session)
+
+    def matches(self, url):
+        return self.index.match(url) is not None
+
+    def _session(self, upstream):
+        key = (threading.get_ident(), upstream)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = Session(connections=self.connections)
+            return session
+
+    def _pooled(self, session):
+        return (
+            self.connections is not None
+            and getattr(session, "ssl_context", None) is None
+            and getattr(session, "_cookie_tracker", None) is None
+        )
+
+    async def send(self, session, request):
+        parts = urlsplit(request.url)
+        upstream = (parts.scheme, parts.netloc)
+        if self._pooled(session):
+            session = self._session(upstream)
+        start = time.monotonic()
+        try:
+            return await _real_request(
+                session,
+                request.method,
+                request.url,
+                headers=request.headers,
+                **request.kwargs
+            )
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                timing = self.timings.get(upstream)
+                if timing is None:
+                    timing = self.timings[upstream] = PassthruTiming()
+                timing.add(elapsed)
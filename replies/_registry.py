@@ -0,0 +1,431 @@
+import heapq
+import itertools
+import re
+import threading
+
+from collections import OrderedDict, deque
+from operator import attrgetter
+from urllib.parse import urlsplit
+
+from ._utils import Pattern, _upstream
+
+
+try:
+    from re import _parser as _sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_parse as _sre_parse
+
+
+# zero width assertions a match at the start of an url always satisfies
+_START = (_sre_parse.AT_BEGINNING, _sre_parse.AT_BEGINNING_STRING)
+
+
+def _route_key(reply):
+    # string urls are indexed on (method, url without query string),
+    # anything else (regexes, custom urls) is not indexed.
+    if reply._compiled_url is None:
+        return None
+    return reply.method, reply._compiled_url.without_qs
+
+
+def _route_host(reply, prefix=None):
+    # regex urls have a host when their literal prefix holds all of it
+    if reply._compiled_url is not None:
+        url = reply._compiled_url.url
+    elif prefix and _upstream(prefix) is not None:
+        url = prefix
+    else:
+        return None
+    return urlsplit(url).hostname
+
+
+def _literal_prefix(pattern):
+    """The literal text any url matched by ``pattern`` starts with."""
+    if not isinstance(pattern.pattern, str) or pattern.flags & re.IGNORECASE:
+        return ""
+    prefix = []
+    for op, value in _sre_parse.parse(pattern.pattern, pattern.flags):
+        if op == _sre_parse.LITERAL:
+            prefix.append(chr(value))
+        elif not (op == _sre_parse.AT and value in _START):
+            break
+    return "".join(prefix)
+
+
+class Route(object):
+    """
+    A registered reply, as returned by ``AsksMock.add``: a handle to remove,
+    disable or re-enable it in constant time, or to replace it, which only
+    moves this route when the new reply is looked up elsewhere.
+    """
+
+    __slots__ = (
+        "seq", "reply", "key", "host", "prefix", "enabled", "removed", "registry"
+    )
+
+    def __init__(self, seq, reply, key, registry=None):
+        self.seq = seq
+        self.reply = reply
+        self.key = key
+        self.prefix = _literal_prefix(reply.url) if isinstance(reply.url, Pattern) else None
+        self.host = _route_host(reply, self.prefix)
+        self.enabled = True
+        self.removed = False
+        self.registry = registry
+
+    def __repr__(self):
+        return "<Route {0} {1!r} {2!r}>".format(
+            self.seq, self.reply.method, self.reply.url
+        )
+
+    def _starts_with(self, prefix):
+        # whether every url this route matches starts with ``prefix``
+        if self.prefix is not None:
+            return self.prefix.startswith(prefix)
+        return self.host is not None and self.reply._compiled_url.url.startswith(prefix)
+
+    def remove(self):
+        self.registry.discard(self)
+
+    def replace(self, reply):
+        """Serves ``reply`` in place of this route's reply, at the same rank."""
+        self.registry.replace_route(self, reply)
+
+    def disable(self):
+        self.registry.set_enabled(self, False)
+
+    def enable(self):
+        self.registry.set_enabled(self, True)
+
+
+def _seq_position(routes, seq):
+    """Where ``seq`` goes in ``routes``, which are sorted by seq."""
+    lo, hi = 0, len(routes)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if routes[mid].seq < seq:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class MissCache(object):
+    """
+    The last ``maxsize`` requests that matched no route, as an LRU so that
+    requests with ever changing urls do not grow it for the whole run.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+    def clear(self):
+        self._keys.clear()
+
+
+class RegexIndex(object):
+    """
+    The regex routes of a method, bucketed by the literal prefix of their
+    regex, so an url is only matched against the regexes whose prefix it
+    starts with: one dict lookup per distinct prefix length, then the
+    regexes of the buckets found.
+    """
+
+    def __init__(self, routes):
+        self._buckets = {}
+        for route in routes:
+            self._buckets.setdefault(route.prefix, []).append(route)
+        self._lengths = sorted({len(prefix) for prefix in self._buckets})
+
+    def match(self, url):
+        """Returns the routes whose regex matches ``url``, in registration order."""
+        found = []
+        for length in self._lengths:
+            if length > len(url):
+                break
+            bucket = self._buckets.get(url[:length])
+            if bucket:
+                found.extend(route for route in bucket if route.reply.url.match(url))
+        if len(self._lengths) > 1:
+            found.sort(key=attrgetter("seq"))
+        return found
+
+
+class RouteRegistry(object):
+    """
+    The registered replies of an ``AsksMock``, in registration order.
+
+    String urls are looked up in a hash index keyed on method and url
+    without query string, regex urls go through a ``RegexIndex``
+    built lazily per method, everything else is scanned in order. The last
+    requests that did not match anything are remembered until the registry
+    changes.
+
+    Removed routes are only flagged, lookups skip them, and the lookup
+    structures are rebuilt once they hold more removed routes than live
+    ones. Routes are also indexed by host for bulk operations.
+
+    Every operation holds the registry lock and none of them awaits, so
+    the tasks and threads sharing a registry consume each reply once.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._seq = itertools.count()
+            self._routes = {}
+            self._hosts = {}
+            self._reset_lookups()
+
+    def _reset_lookups(self):
+        self._index = {}
+        self._patterns = []
+        self._regex_indexes = {}
+        self._fallback = []
+        self._misses = MissCache()
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __iter__(self):
+        return (route.reply for route in self.routes())
+
+    def __contains__(self, reply):
+        return any(r == reply for r in self)
+
+    def routes(self, host=None, prefix=None):
+        """
+        The live routes, in registration order, optionally only those of
+        ``host`` or whose url starts with ``prefix``. Regex routes count
+        through the literal text their regex starts with.
+        """
+        with self._lock:
+            if host is not None:
+                routes = list(self._hosts.get(host.lower(), {}).values())
+            elif prefix is not None and _upstream(prefix) is not None:
+                # the prefix holds the whole host, only its routes can match
+                hostname = urlsplit(prefix).hostname
+                routes = list(self._hosts.get(hostname, {}).values())
+            else:
+                routes = list(self._routes.values())
+        if prefix is not None:
+            routes = [r for r in routes if r._starts_with(prefix)]
+        routes.sort(key=attrgetter("seq"))
+        return routes
+
+    def _lookup(self, route, create=False):
+        # the lookup list a route is placed in
+        if route.key is not None:
+            bucket = self._index.get(route.key)
+            if bucket is None and create:
+                bucket = self._index[route.key] = deque()
+            return bucket
+        if isinstance(route.reply.url, Pattern):
+            return self._patterns
+        return self._fallback
+
+    def _place(self, route):
+        # lookups are kept sorted by seq, new routes go last
+        routes = self._lookup(route, create=True)
+        if not routes or routes[-1].seq < route.seq:
+            routes.append(route)
+        else:
+            routes.insert(_seq_position(routes, route.seq), route)
+
+    def _unplace(self, route):
+        routes = self._lookup(route)
+        if routes:
+            i = _seq_position(routes, route.seq)
+            if i < len(routes) and routes[i] is route:
+                del routes[i]
+            if not routes and route.key is not None:
+                del self._index[route.key]
+
+    def _add(self, reply, seq=None):
+        route = Route(next(self._seq) if seq is None else seq, reply, _route_key(reply), self)
+        self._routes[route.seq] = route
+        if route.host is not None:
+            self._hosts.setdefault(route.host, {})[route.seq] = route
+        self._place(route)
+        return route
+
+    def append(self, reply):
+        with self._lock:
+            route = self._add(reply)
+            if isinstance(reply.url, Pattern):
+                self._regex_indexes.clear()
+            self._misses.clear()
+            return route
+
+    def extend(self, replies):
+        """Appends many replies, invalidating the caches only once."""
+        with self._lock:
+            patterns = len(self._patterns)
+            routes = [self._add(reply) for reply in replies]
+            if len(self._patterns) != patterns:
+                self._regex_indexes.clear()
+            self._misses.clear()
+            return routes
+
+    def _discard(self, route):
+        if route.removed:
+            return
+        route.removed = True
+        del self._routes[route.seq]
+        if route.host is not None:
+            del self._hosts[route.host][route.seq]
+            if not self._hosts[route.host]:
+                del self._hosts[route.host]
+        self._dead += 1
+        bucket = self._index.get(route.key) if route.key is not None else None
+        if bucket is not None:
+            # consuming the head of a sequence does not leave a tombstone
+            while bucket and bucket[0].removed:
+                bucket.popleft()
+                self._dead -= 1
+            if not bucket:
+                del self._index[route.key]
+        if self._dead > len(self._routes):
+            self._compact()
+
+    def _compact(self):
+        misses = self._misses
+        self._reset_lookups()
+        for route in sorted(self._routes.values(), key=attrgetter("seq")):
+            self._place(route)
+        self._misses = misses
+
+    def discard(self, route):
+        with self._lock:
+            self._discard(route)
+            self._misses.clear()
+
+    def remove(self, reply):
+        with self._lock:
+            for route in [r for r in self._routes.values() if r.reply == reply]:
+                self._discard(route)
+            self._misses.clear()
+
+    def remove_routes(self, host=None, prefix=None):
+        """Removes the routes of ``host`` or starting with ``prefix``."""
+        with self._lock:
+            routes = self.routes(host=host, prefix=prefix)
+            for route in routes:
+                self._discard(route)
+            self._misses.clear()
+            return routes
+
+    def replace_route(self, route, reply):
+        with self._lock:
+            if route.removed:
+                raise ValueError("{0!r} was removed".format(route))
+            if route.key is not None and _route_key(reply) == route.key:
+                # same url, so same host and lookup
+                route.reply = reply
+            else:
+                # only this route moves to other lookups, at the same rank
+                if isinstance(route.reply.url, Pattern) or isinstance(reply.url, Pattern):
+                    self._regex_indexes.clear()
+                self._unplace(route)
+                if route.host is not None:
+                    del self._hosts[route.host][route.seq]
+                    if not self._hosts[route.host]:
+                        del self._hosts[route.host]
+                enabled = route.enabled
+                route.__init__(route.seq, reply, _route_key(reply), self)
+                route.enabled = enabled
+                if route.host is not None:
+                    self._hosts.setdefault(route.host, {})[route.seq] = route
+                self._place(route)
+            self._misses.clear()
+
+    def replace(self, reply):
+        with self._lock:
+            for route in self._routes.values():
+                if route.reply == reply:
+                    self.replace_route(route, reply)
+                    return route
+        raise ValueError("{0!r} is not registered".format(reply))
+
+    def set_enabled(self, route, enabled):
+        with self._lock:
+            route.enabled = enabled
+            self._misses.clear()
+
+    def _regex_index(self, method):
+        try:
+            return self._regex_indexes[method]
+        except KeyError:
+            routes = [
+                r for r in self._patterns if r.reply.method == method and not r.removed
+            ]
+            index = self._regex_indexes[method] = RegexIndex(routes)
+            return index
+
+    def _candidates(self, request, url):
+        sources = [
+            self._index.get((request.method, url.without_qs), ()),
+            self._regex_index(request.method).match(url.raw) if self._patterns else (),
+            self._fallback,
+        ]
+        sources = [source for source in sources if source]
+        if len(sources) == 1:
+            return sources[0]
+        return heapq.merge(*sources, key=attrgetter("seq"))
+
+    def find(self, request, url):
+        """
+        Returns the first reply matching ``request``, or None. ``url`` is the
+        ``RequestURL`` of the request, shared by every candidate reply.
+
+        When several replies match, the first one is removed from the
+        registry so that the next one gets served by the following request.
+        Replies that are not ``consumable`` stay registered and hand out
+        their ``next_reply()`` instead, under the registry lock so that two
+        requests never race for the last reply of a sequence.
+        """
+        miss_key = (request.method, url.raw)
+        with self._lock:
+            if miss_key in self._misses:
+                return None
+
+            found = None
+            for route in self._candidates(request, url):
+                if route.removed or not route.enabled:
+                    continue
+                if route.reply.matches(request, url):
+                    if found is not None:
+                        self._discard(found)
+                        return found.reply
+                    if route.reply.consumable:
+                        found = route
+                        continue
+                    served = route.reply.next_reply()
+                    if served is not None:
+                        return served
+
+            if found is None:
+                self._misses.add(miss_key)
+                return None
+            return found.reply
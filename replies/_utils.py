@@ -1,27 +1,17 @@
 import _io
+import importlib
 import inspect
+import json as json_module
 import logging
+import mmap
+import os
 import re
-import six
+import stat
 
-from collections import namedtuple, Sequence, Sized
-from functools import update_wrapper
+from collections import namedtuple
+from functools import lru_cache, update_wrapper
 
-#from requests.sessions import REDIRECT_STATI
-
-#try:
-#    from requests.packages.urllib3.response import HTTPResponse
-#except ImportError:
-#    from urllib3.response import HTTPResponse
-
-from urllib.parse import urlsplit, urlunsplit, quote
-
-from io import BytesIO as BufferIO
-
-try:
-    from unittest import mock as std_mock
-except ImportError:
-    import mock as std_mock
+from urllib.parse import urlsplit, urlunsplit, urlparse, parse_qsl, quote
 
 try:
     Pattern = re._pattern_type
@@ -32,6 +22,10 @@ except AttributeError:
 
 Call = namedtuple("Call", ["request", "response"])
 
+# A registered url, cleaned and split once so matching only has to parse
+# the request side.
+RegisteredURL = namedtuple("RegisteredURL", ["url", "without_qs", "parts", "query"])
+
 
 _wrapper_template = """\
 def wrapper%(signature)s:
@@ -39,11 +33,19 @@ def wrapper%(signature)s:
         return func%(funcargs)s
 """
 
+_async_wrapper_template = """\
+async def wrapper%(signature)s:
+    with replies:
+        return await func%(funcargs)s
+"""
+
+REDIRECT_STATI = (301, 302, 303, 305, 307, 308)
+
 
 
 
 def _is_string(s):
-    return isinstance(s, six.string_types)
+    return isinstance(s, str)
 
 
 def _has_unicode(s):
@@ -64,7 +66,7 @@ def _clean_unicode(url):
         url = urlunsplit(urllist)
 
     # Clean up path/query/params, which use url-encoding to handle unicode chars
-    if isinstance(url.encode("utf8"), six.string_types):
+    if isinstance(url.encode("utf8"), str):
         url = url.encode("utf8")
     chars = list(url)
     for i, x in enumerate(chars):
@@ -74,18 +76,15 @@ def _clean_unicode(url):
     return "".join(chars)
 
 
-def _is_redirect(response):
-    try:
-        # 2.0.0 <= requests <= 2.2
-        return response.is_redirect
+async def _maybe_await(result):
+    # callbacks may be plain functions or coroutine functions
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
 
-    except AttributeError:
-        # requests > 2.2
-        return (
-            # use request.sessions conditional
-            response.status_code in REDIRECT_STATI
-            and "location" in response.headers
-        )
+def _is_redirect(response):
+    return response.status_code in REDIRECT_STATI and "location" in response.headers
 
 
 def get_wrapped(func, wrapper_template, evaldict):
@@ -102,7 +101,7 @@ def get_wrapped(func, wrapper_template, evaldict):
     callargs = inspect.formatargspec(args, a, kw, None)
 
     ctx = {"signature": signature, "funcargs": callargs}
-    six.exec_(wrapper_template % ctx, evaldict)
+    exec(wrapper_template % ctx, evaldict)
 
     wrapper = evaldict["wrapper"]
 
@@ -112,40 +111,260 @@ def get_wrapped(func, wrapper_template, evaldict):
     return wrapper
 
 
-class CallList(Sequence, Sized):
-    def __init__(self):
-        self._calls = []
+def _ensure_url_default_path(url):
+    if _is_string(url):
+        url_parts = list(urlsplit(url))
+        if url_parts[2] == "":
+            url_parts[2] = "/"
+        url = urlunsplit(url_parts)
+    return url
+
+
+def _compile_url(url):
+    if not _is_string(url):
+        return None
+    if _has_unicode(url):
+        url = _clean_unicode(url)
+    parsed = urlparse(url)
+    return RegisteredURL(
+        url=url,
+        without_qs=url.split("?", 1)[0],
+        parts=parsed[:3],
+        query=tuple(sorted(parse_qsl(parsed.query))),
+    )
+
+
+class RequestURL(object):
+    """
+    The url of an incoming request, normalized once and shared by every
+    reply it is matched against.
+
+    ``raw`` is the url as requested (regexes match against it), ``url`` is
+    the same url with unicode cleaned up like registered urls are. The split
+    parts and query pairs are only computed for strict matching.
+    """
+
+    __slots__ = ("raw", "url", "without_qs", "_parsed", "_query")
+
+    def __init__(self, url):
+        self.raw = url
+        # ascii urls are by far the most common, they need no cleaning
+        self.url = url if url.isascii() else _clean_unicode(url)
+        self.without_qs = self.url.split("?", 1)[0]
+        self._parsed = None
+        self._query = None
+
+    def __repr__(self):
+        return "<RequestURL {0!r}>".format(self.raw)
+
+    def _parse(self):
+        if self._parsed is None:
+            self._parsed = urlparse(self.url)
+        return self._parsed
+
+    @property
+    def parts(self):
+        return self._parse()[:3]
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = tuple(sorted(parse_qsl(self._parse().query)))
+        return self._query
 
-    def __iter__(self):
-        return iter(self._calls)
+
+def _upstream(url):
+    """
+    The (scheme, host) of ``url``, None when it has no complete host, such
+    as a prefix ending in the middle of its host name.
+    """
+    scheme, sep, rest = url.partition("://")
+    if not sep:
+        return None
+    host, slash, _ = rest.partition("/")
+    if not slash:
+        return None
+    return scheme, host
+
+
+@lru_cache(maxsize=1024)
+def _request_url(url):
+    return RequestURL(url)
+
+
+class BodyReader(object):
+    """
+    A read-only file-like cursor over a body buffer.
+
+    Each request gets its own reader, all of them share the reply's buffer
+    through a ``memoryview``: the payload is not copied, reading it whole
+    returns the buffer itself.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._view = memoryview(buffer)
+        self._pos = 0
+        self.closed = False
 
     def __len__(self):
-        return len(self._calls)
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed body")
+        start = min(self._pos, len(self._view))
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(start + size, len(self._view))
+        self._pos = end
+        if start == 0 and end == len(self._view) and isinstance(self._buffer, bytes):
+            return self._buffer
+        return self._view[start:end].tobytes()
+
+    def readinto(self, b):
+        data = self._view[self._pos:self._pos + len(b)]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        self.closed = True
+        self._view.release()
+
+
+def _map_file(f):
+    """
+    Maps the rest of file ``f`` read-only in memory. The mapping outlives
+    the file, which can be closed afterwards.
+
+    Files that cannot be mapped (pipes, sockets...) are returned as is.
+    """
+    try:
+        fileno = f.fileno()
+        info = os.fstat(fileno)
+        offset = f.tell()
+    except (AttributeError, OSError, _io.UnsupportedOperation):
+        return f
+    # only regular files have a meaningful size
+    if not stat.S_ISREG(info.st_mode):
+        return f
+    size = info.st_size
+    if size <= offset:
+        return b""
+    try:
+        mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return f
+    return memoryview(mapping)[offset:] if offset else mapping
 
-    def __getitem__(self, idx):
-        return self._calls[idx]
 
-    def add(self, request, response):
-        self._calls.append(Call(request, response))
+# the module json bodies are encoded and request bodies decoded with
+_json = json_module
 
-    def reset(self):
-        self._calls = []
 
+def set_json_codec(codec=None):
+    """
+    Sets the module ``json`` replies are encoded with, and that
+    ``Request.json()`` decodes request bodies with. ``codec`` is a module or
+    object with ``dumps`` and ``loads``, or the name of one, such as
+    ``"orjson"`` or ``"ujson"``. A name that cannot be imported falls back to
+    the standard library ``json``, as does ``None``. Returns the codec in use.
+
+    >>> replies.set_json_codec("orjson")
+    """
+    global _json
+    if isinstance(codec, str):
+        try:
+            codec = importlib.import_module(codec)
+        except ImportError:
+            codec = None
+    _json = json_module if codec is None else codec
+    return _json
 
-def _ensure_url_default_path(url):
-    if _is_string(url):
-        url_parts = list(urlsplit(url))
-        if url_parts[2] == "":
-            url_parts[2] = "/"
-        url = urlunsplit(url_parts)
-    return url
+
+def _json_dumps(obj):
+    data = _json.dumps(obj)
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def _json_loads(data):
+    return _json.loads(data)
+
+
+def _to_bytes(chunk):
+    if isinstance(chunk, str):
+        return chunk.encode("utf-8")
+    return bytes(chunk)
+
+
+class ChunkedBody(object):
+    """
+    A lazy body, sent with chunked transfer encoding: chunks are pulled
+    from a sync or async iterator only as the client reads them.
+    """
+
+    def __init__(self, source):
+        self._source = source
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        if hasattr(self._source, "__aiter__"):
+            async for chunk in self._source:
+                yield _to_bytes(chunk)
+        else:
+            for chunk in self._source:
+                yield _to_bytes(chunk)
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self])
+
+    async def close(self):
+        if hasattr(self._source, "aclose"):
+            await self._source.aclose()
+        elif hasattr(self._source, "close"):
+            self._source.close()
+
+
+def _is_chunked(body):
+    return hasattr(body, "__aiter__") or (
+        hasattr(body, "__iter__")
+        and not isinstance(body, (str, bytes, bytearray, memoryview, mmap.mmap))
+    )
 
 
 def _handle_body(body):
-    if isinstance(body, six.text_type):
+    if isinstance(body, str):
         body = body.encode("utf-8")
     if isinstance(body, _io.BufferedReader):
         return body
-
-    return BufferIO(body)
+    if body is None:
+        body = b""
+    # generator functions give a fresh stream to every request
+    if inspect.isgeneratorfunction(body) or inspect.isasyncgenfunction(body):
+        body = body()
+    if _is_chunked(body):
+        return ChunkedBody(body)
+
+    return BodyReader(body)
 
@@ -0,0 +1,146 @@
+"""
+Latency distributions and bandwidth caps for replies.
+
+A reply given a ``latency`` waits for a delay drawn from it before
+answering. The wait is an async sleep, so delayed requests only cost a
+suspended task. Every distribution owns its random generator, pass a
+``seed`` to get the same delays on every run:
+
+>>> replies.add(replies.GET, 'http://example.com', latency=0.2)
+>>> replies.add(
+>>>     replies.GET, 'http://example.com',
+>>>     latency=replies.latency.LogNormal(median=0.1, sigma=0.5, seed=42),
+>>> )
+
+A reply given a ``bandwidth`` paces its body, in bytes per second:
+
+>>> replies.add(
+>>>     replies.GET, 'http://example.com/big', body_file='big.bin', stream=True,
+>>>     bandwidth=replies.latency.Bandwidth(64 * 1024, chunk_size=4096, first_byte=0.3),
+>>> )
+"""
+import bisect
+import math
+import numbers
+import random
+
+
+class Latency(object):
+    def __init__(self, seed=None):
+        self._random = random.Random(seed)
+
+    def sample(self):
+        """Returns the next delay, in seconds."""
+        raise NotImplementedError
+
+
+class Fixed(Latency):
+    def __init__(self, delay):
+        super(Fixed, self).__init__()
+        self.delay = delay
+
+    def sample(self):
+        return self.delay
+
+
+class Uniform(Latency):
+    def __init__(self, low, high, seed=None):
+        super(Uniform, self).__init__(seed)
+        self.low = low
+        self.high = high
+
+    def sample(self):
+        return self._random.uniform(self.low, self.high)
+
+
+class Normal(Latency):
+    """Normal jitter around ``mean``, negative draws are clamped to 0."""
+
+    def __init__(self, mean, stddev, seed=None):
+        super(Normal, self).__init__(seed)
+        self.mean = mean
+        self.stddev = stddev
+
+    def sample(self):
+        return max(0.0, self._random.gauss(self.mean, self.stddev))
+
+
+class LogNormal(Latency):
+    """Long tailed delays: ``median`` is the median, ``sigma`` the log spread."""
+
+    def __init__(self, median, sigma, seed=None):
+        super(LogNormal, self).__init__(seed)
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self):
+        return self._random.lognormvariate(math.log(self.median), self.sigma)
+
+
+class Percentiles(Latency):
+    """
+    Delays following a percentile table, as read off a latency histogram,
+    interpolating linearly between percentiles:
+
+    >>> Percentiles({50: 0.05, 90: 0.2, 99: 1.5})
+    """
+
+    def __init__(self, table, seed=None):
+        super(Percentiles, self).__init__(seed)
+        if not table:
+            raise ValueError("Percentiles needs at least one percentile")
+        points = sorted(table.items())
+        for pct, _ in points:
+            if not 0 <= pct <= 100:
+                raise ValueError("Percentile {0!r} is not in [0, 100]".format(pct))
+        self._pcts = [pct for pct, _ in points]
+        self._delays = [delay for _, delay in points]
+
+    def sample(self):
+        pct = self._random.uniform(0, 100)
+        i = bisect.bisect_left(self._pcts, pct)
+        if i == 0:
+            return self._delays[0]
+        if i == len(self._pcts):
+            return self._delays[-1]
+        lo, hi = self._pcts[i - 1], self._pcts[i]
+        ratio = (pct - lo) / (hi - lo)
+        return self._delays[i - 1] + ratio * (self._delays[i] - self._delays[i - 1])
+
+
+class Bandwidth(object):
+    """
+    Caps the body throughput of a reply to ``rate`` bytes per second.
+
+    Streamed bodies are sent in ``chunk_size`` chunks, each one released
+    when the rate allows it, the first one after an extra ``first_byte``
+    seconds. Other bodies are returned once they would have been fully
+    received.
+    """
+
+    def __init__(self, rate, chunk_size=None, first_byte=0):
+        if rate <= 0:
+            raise ValueError("Bandwidth rate must be positive, not {0!r}".format(rate))
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.first_byte = first_byte
+
+    def transfer_time(self, size):
+        """Seconds it takes to receive ``size`` bytes, from the request on."""
+        return self.first_byte + size / self.rate
+
+
+def _as_bandwidth(bandwidth):
+    if bandwidth is None or isinstance(bandwidth, Bandwidth):
+        return bandwidth
+    if isinstance(bandwidth, numbers.Real):
+        return Bandwidth(bandwidth)
+    raise TypeError("Unsupported bandwidth {0!r}".format(bandwidth))
+
+
+def _as_latency(latency):
+    if latency is None or isinstance(latency, Latency):
+        return latency
+    if isinstance(latency, numbers.Real):
+        return Fixed(latency)
+    raise TypeError("Unsupported latency {0!r}".format(latency))
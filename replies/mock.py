@@ -1,22 +1,10 @@
+import inspect
 import re
-from cookies import Cookies
+import threading
 
-# from requests.exceptions import ConnectionError
-# from requests.utils import cookiejar_from_dict
+from functools import partialmethod
 
-#try:
-#    from requests.packages.urllib3.response import HTTPResponse
-#except ImportError:
-#    from urllib3.response import HTTPResponse
-
-
-#from requests.adapters import HTTPAdapter
-_real_send = HTTPAdapter.send
-
-try:
-    from unittest import mock as std_mock
-except ImportError:
-    import mock as std_mock
+from asks.errors import RequestTimeout, TooManyRedirects
 
 try:
     Pattern = re._pattern_type
@@ -24,12 +12,30 @@ except AttributeError:
     # Python 3.7
     Pattern = re.Pattern
 
-from ._utils import CallList, _has_unicode, _clean_unicode, _wrapper_template, get_wrapped
-from .reply import Reply, BaseReply, CallbackReply
+from ._asks import Request, StreamBody, SESSION_METHODS
+from ._calls import CallList
+from ._cassette import Cassette, CassetteWriter
+from ._clock import RealClock, _current_clock, _within
+from ._loader import DEFAULT_CACHE_DIR, load_replies, reply_from_spec
+from ._passthru import PassthruDispatcher, PrefixIndex
+from ._utils import (
+    _has_unicode,
+    _clean_unicode,
+    _is_redirect,
+    _maybe_await,
+    _request_url,
+    _wrapper_template,
+    _async_wrapper_template,
+    get_wrapped,
+)
+from .reply import Reply, BaseReply, CallbackReply, SequenceReply
+from ._registry import RouteRegistry
 
 import logging
 logger = logging.getLogger("replies")
 
+DEFAULT_TARGET = "asks.sessions.BaseSession.request"
+
 
 class AsksMock(object):
     DELETE = "DELETE"
@@ -46,18 +52,54 @@ class AsksMock(object):
         assert_all_requests_are_fired=True,
         response_callback=None,
         passthru_prefixes=(),
-        target="requests.adapters.HTTPAdapter.send",
+        target=DEFAULT_TARGET,
+        virtual_time=False,
+        calls=None,
+        passthru_connections=10,
     ):
-        self._calls = CallList()
+        # ``calls`` is a ``CallList`` with its own retention policy
+        self._calls = CallList() if calls is None else calls
+        # guards the call counts and rate limit windows of the replies
+        self._lock = threading.Lock()
+        self._passthru = PassthruDispatcher(
+            passthru_prefixes, connections=passthru_connections
+        )
+        self.virtual_time = virtual_time
         self.reset()
         self.assert_all_requests_are_fired = assert_all_requests_are_fired
         self.response_callback = response_callback
-        self.passthru_prefixes = tuple(passthru_prefixes)
         self.target = target
 
     def reset(self):
-        self._matches = []
+        self._matches = RouteRegistry()
         self._calls.reset()
+        self._clock = None
+        self._passthru.reset()
+        self._stop_cassettes()
+
+    @property
+    def passthru_prefixes(self):
+        return self._passthru.index.prefixes
+
+    @passthru_prefixes.setter
+    def passthru_prefixes(self, prefixes):
+        self._passthru.index = PrefixIndex(prefixes)
+
+    @property
+    def passthru_timings(self):
+        """
+        The passthru requests timings, a ``PassthruTiming`` per (scheme,
+        host) with their count, total, min, max and mean durations.
+        """
+        return self._passthru.timings
+
+    def _stop_cassettes(self):
+        for cassette in getattr(self, "_cassettes", ()):
+            cassette.close()
+        if getattr(self, "_recorder", None) is not None:
+            self._recorder.close()
+        self._cassettes = []
+        self._recorder = None
 
     def add(
         self,
@@ -102,15 +144,67 @@ class AsksMock(object):
         >>>     url='http://example.com?foo=bar',
         >>>     match_querystring=True
         >>> )
+
+        Returns the ``Route`` of the reply, a handle to remove, replace,
+        disable or enable it later:
+
+        >>> route = replies.add(replies.GET, 'http://example.com')
+        >>> route.disable()
         """
         if isinstance(method, BaseReply):
-            self._matches.append(method)
-            return
+            return self._matches.append(method)
 
         if adding_headers is not None:
             kwargs.setdefault("headers", adding_headers)
 
-        self._matches.append(Reply(method=method, url=url, body=body, **kwargs))
+        return self._matches.append(Reply(method=method, url=url, body=body, **kwargs))
+
+    def add_many(self, replies):
+        """
+        Registers many replies at once. Each one is a ``BaseReply`` or a
+        mapping of ``Reply`` arguments.
+
+        >>> replies.add_many([
+        >>>     {'method': 'GET', 'url': 'http://example.com/a', 'body': 'a'},
+        >>>     {'method': 'GET', 'url': 'http://example\\.com/\\d+', 'regex': True},
+        >>> ])
+        """
+        return self._matches.extend([reply_from_spec(reply) for reply in replies])
+
+    def load(self, path, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Registers the replies described in a JSON, YAML or TOML file. The
+        replies built are cached in ``cache_dir``, keyed by the content of
+        the file, pass None to disable the cache.
+
+        >>> replies.load('fixtures/api.yaml')
+        """
+        return self._matches.extend(load_replies(path, cache_dir=cache_dir))
+
+    def add_sequence(
+        self, method, url, replies, policy="repeat_last", match_querystring=False
+    ):
+        """
+        Registers replies served one after the other to the requests for
+        ``method`` and ``url``. Each reply is a ``BaseReply`` or a mapping of
+        ``Reply`` arguments. Once all of them were served, ``policy`` is
+        ``"repeat_last"``, ``"cycle"`` or ``"exhaust"``.
+
+        >>> replies.add_sequence(replies.GET, 'http://example.com/job', [
+        >>>     {'json': {'state': 'pending'}},
+        >>>     {'json': {'state': 'done'}},
+        >>> ])
+        """
+        sequence = [
+            reply_from_spec(dict({"method": method, "url": url}, **reply))
+            if isinstance(reply, dict)
+            else reply
+            for reply in replies
+        ]
+        reply = SequenceReply(
+            method, url, sequence, policy=policy, match_querystring=match_querystring
+        )
+        return self._matches.append(reply)
 
     def add_passthru(self, prefix):
         """
@@ -123,7 +217,28 @@ class AsksMock(object):
         """
         if _has_unicode(prefix):
             prefix = _clean_unicode(prefix)
-        self.passthru_prefixes += (prefix,)
+        self._passthru.index.add(prefix)
+
+    def record(self, path):
+        """
+        Records the responses of passthru requests to the cassette ``path``,
+        written when the mock is reset. Streamed responses are not recorded.
+
+        >>> replies.add_passthru('https://example.com')
+        >>> replies.record('example.cassette')
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+        self._recorder = CassetteWriter(path)
+
+    def replay(self, path):
+        """
+        Answers requests that do not match any reply from the cassette
+        ``path``, when it recorded them.
+
+        >>> replies.replay('example.cassette')
+        """
+        self._cassettes.append(Cassette(path))
 
     def remove(self, method_or_response=None, url=None):
         """
@@ -139,8 +254,25 @@ class AsksMock(object):
         else:
             response = BaseReply(method=method_or_response, url=url)
 
-        while response in self._matches:
-            self._matches.remove(response)
+        self._matches.remove(response)
+
+    def routes(self, host=None, prefix=None):
+        """
+        The routes registered, or only those of ``host`` or whose url starts
+        with ``prefix``, to disable a whole upstream at once for instance:
+
+        >>> for route in replies.routes(host='api.example.com'):
+        >>>     route.disable()
+        """
+        return self._matches.routes(host=host, prefix=prefix)
+
+    def remove_host(self, host):
+        """Removes every reply for urls of ``host``, returns their routes."""
+        return self._matches.remove_routes(host=host)
+
+    def remove_prefix(self, prefix):
+        """Removes every reply for urls starting with ``prefix``."""
+        return self._matches.remove_routes(prefix=prefix)
 
     def replace(self, method_or_response=None, url=None, body="", *args, **kwargs):
         """
@@ -156,22 +288,30 @@ class AsksMock(object):
         else:
             response = Reply(method=method_or_response, url=url, body=body, **kwargs)
 
-        index = self._matches.index(response)
-        self._matches[index] = response
+        self._matches.replace(response)
 
     def add_callback(
-        self, method, url, callback, match_querystring=False, content_type="text/plain"
+        self,
+        method,
+        url,
+        callback,
+        match_querystring=False,
+        content_type="text/plain",
+        latency=None,
+        bandwidth=None,
     ):
         # ensure the url has a default path set if the url is a string
         # url = _ensure_url_default_path(url, match_querystring)
 
-        self._matches.append(
+        return self._matches.append(
             CallbackReply(
                 url=url,
                 method=method,
                 callback=callback,
                 content_type=content_type,
                 match_querystring=match_querystring,
+                latency=latency,
+                bandwidth=bandwidth,
             )
         )
 
@@ -179,6 +319,19 @@ class AsksMock(object):
     def calls(self):
         return self._calls
 
+    @property
+    def clock(self):
+        """
+        The clock reply delays, rate limits and timeouts run on.
+
+        With ``virtual_time``, this is trio's clock when trio runs with a
+        ``MockClock``, and a replies ``VirtualClock`` otherwise: simulated
+        delays then take no real time but keep their order.
+        """
+        if self._clock is None:
+            self._clock = _current_clock() if self.virtual_time else RealClock()
+        return self._clock
+
     def __enter__(self):
         self.start()
         return self
@@ -191,30 +344,80 @@ class AsksMock(object):
 
     def activate(self, func):
         evaldict = {"replies": self, "func": func}
+        if inspect.iscoroutinefunction(func):
+            return get_wrapped(func, _async_wrapper_template, evaldict)
         return get_wrapped(func, _wrapper_template, evaldict)
 
-    def _find_match(self, request):
-        found = None
-        found_match = None
-        for i, match in enumerate(self._matches):
-            if match.matches(request):
-                if found is None:
-                    found = i
-                    found_match = match
-                else:
-                    # Multiple matches found.  Remove & return the first match.
-                    return self._matches.pop(found)
+    def _find_match(self, request, url=None):
+        if url is None:
+            url = _request_url(request.url)
+        return self._matches.find(request, url)
+
+    async def _on_request(self, session, method, url=None, **kwargs):
+        request = Request.from_session(session, method, url, **kwargs)
+        response = await self._send(session, request)
+        if not request.follow_redirects:
+            return response
+
+        history = []
+        while _is_redirect(response):
+            if len(history) >= request.max_redirects:
+                raise TooManyRedirects(
+                    "Exceeded {0} redirects for {1}".format(
+                        request.max_redirects, request.url
+                    )
+                )
+            history.append(response)
+            request = request.redirect(response)
+            response = await self._send(session, request)
+        response.history = history
+        return response
+
+    async def _response_callback(self, response):
+        if self.response_callback is None:
+            return response
+        return await _maybe_await(self.response_callback(response))
 
-        return found_match
+    async def _delay(self, match):
+        if match.latency is not None:
+            await self.clock.sleep(match.latency.sample())
 
-    def _on_request(self, adapter, request, **kwargs):
-        match = self._find_match(request)
-        resp_callback = self.response_callback
+    async def _shape(self, bandwidth, response):
+        if isinstance(response.body, StreamBody):
+            response.body.shape(bandwidth, self.clock)
+        else:
+            await self.clock.sleep(bandwidth.transfer_time(len(response.body)))
+
+    async def _respond(self, match, request):
+        """The response of ``match``, after its latency and bandwidth."""
+        await self._delay(match)
+        with self._lock:
+            retry_after = match.retry_after(self.clock.now())
+        if retry_after:
+            return await match.get_rate_limited_response(request, retry_after)
+        response = await match.get_response(request)
+        if match.bandwidth is not None:
+            await self._shape(match.bandwidth, response)
+        return response
+
+    async def _send(self, session, request):
+        match = self._find_match(request, _request_url(request.url))
 
         if match is None:
-            if request.url.startswith(self.passthru_prefixes):
+            for cassette in self._cassettes:
+                offset = cassette.find(request)
+                if offset is not None:
+                    response = await cassette.get_response(request, offset)
+                    response = await self._response_callback(response)
+                    self._calls.add(request, response, elapsed=0)
+                    return response
+
+            if self._passthru.matches(request.url):
                 logger.info("request.allowed-passthru", extra={"url": request.url})
-                return _real_send(adapter, request, **kwargs)
+                response = await self._passthru.send(session, request)
+                if self._recorder is not None and not request.stream:
+                    self._recorder.add(request, response)
+                return response
 
             error_msg = "Connection refused: {0} {1}".format(
                 request.method, request.url
@@ -222,50 +425,74 @@ class AsksMock(object):
             response = ConnectionError(error_msg)
             response.request = request
 
-            self._calls.add(request, response)
-            response = resp_callback(response) if resp_callback else response
+            self._calls.add(request, response, elapsed=0)
+            response = await self._response_callback(response)
             raise response
 
+        clock = self.clock
+        start = clock.now()
         try:
-            response = adapter.build_response(request, match.get_response(request))
+            if request.timeout is None:
+                response = await self._respond(match, request)
+            else:
+                # like asks, the timeout covers the whole response unless
+                # it is streamed, whose reads have their own timeout
+                finished, response = await _within(
+                    clock, request.timeout, self._respond, match, request
+                )
+                if not finished:
+                    raise RequestTimeout(
+                        "Timed out after {0}s: {1} {2}".format(
+                            request.timeout, request.method, request.url
+                        )
+                    )
         except Exception as response:
-            match.call_count += 1
-            self._calls.add(request, response)
-            response = resp_callback(response) if resp_callback else response
+            self._count_call(match)
+            self._calls.add(request, response, elapsed=clock.now() - start)
+            response = await self._response_callback(response)
             raise
 
-        if not match.stream:
-            response.content  # NOQA
-
-        try:
-            resp_cookies = Cookies.from_request(response.headers["set-cookie"])
-            response.cookies = cookiejar_from_dict(
-                dict((v.name, v.value) for _, v in resp_cookies.items())
-            )
-        except (KeyError, TypeError):
-            pass
-
-        response = resp_callback(response) if resp_callback else response
-        match.call_count += 1
-        self._calls.add(request, response)
+        response = await self._response_callback(response)
+        self._count_call(match)
+        self._calls.add(request, response, elapsed=clock.now() - start)
         return response
 
+    def _count_call(self, match):
+        with self._lock:
+            match.call_count += 1
+
     def start(self):
-        def unbound_on_send(adapter, request, *a, **kwargs):
-            return self._on_request(adapter, request, *a, **kwargs)
+        from unittest import mock as std_mock
+
+        async def unbound_on_request(session, method, *a, **kwargs):
+            return await self._on_request(session, method, *a, **kwargs)
 
-        self._patcher = std_mock.patch(target=self.target, new=unbound_on_send)
-        self._patcher.start()
+        self._patchers = [std_mock.patch(target=self.target, new=unbound_on_request)]
+        if self.target == DEFAULT_TARGET:
+            self._patchers.extend(
+                std_mock.patch(
+                    target="asks.sessions.BaseSession.{0}".format(name),
+                    new=partialmethod(unbound_on_request, name.upper()),
+                )
+                for name in SESSION_METHODS
+            )
+        for patcher in self._patchers:
+            patcher.start()
 
     def stop(self, allow_assert=True):
-        self._patcher.stop()
+        for patcher in reversed(self._patchers):
+            patcher.stop()
         if not self.assert_all_requests_are_fired:
             return
 
         if not allow_assert:
             return
 
-        not_called = [m for m in self._matches if m.call_count == 0]
+        not_called = [
+            route.reply
+            for route in self._matches.routes()
+            if route.enabled and route.reply.call_count == 0
+        ]
         if not_called:
             raise AssertionError(
                 "Not all requests have been executed {0!r}".format(
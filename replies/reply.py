@@ -1,18 +1,11 @@
-import json as json_module
+import _io
+import math
+import mmap
 import re
-import six
+import threading
 
-try:
-    from requests.packages.urllib3.response import HTTPResponse
-except ImportError:
-    from urllib3.response import HTTPResponse
-
-from urllib.parse import urlparse, parse_qsl
-
-try:
-    from unittest import mock as std_mock
-except ImportError:
-    import mock as std_mock
+from collections import deque
+from io import BytesIO
 
 try:
     Pattern = re._pattern_type
@@ -21,10 +14,29 @@ except AttributeError:
     Pattern = re.Pattern
 
 
-from ._utils import _ensure_url_default_path, _is_string, _has_unicode, _clean_unicode, _handle_body
+from ._asks import ResponseTemplate, build_response
+from .latency import _as_bandwidth, _as_latency
+from ._utils import (
+    RegisteredURL,
+    RequestURL,
+    _compile_url,
+    _ensure_url_default_path,
+    _is_string,
+    _handle_body,
+    _json_dumps,
+    _map_file,
+    _maybe_await,
+    _request_url,
+)
+
 
+class _Unset(object):
+    def __reduce__(self):
+        # pickled replies refer to this very sentinel
+        return "UNSET"
 
-UNSET = object()
+
+UNSET = _Unset()
 
 
 class BaseReply(object):
@@ -32,14 +44,39 @@ class BaseReply(object):
     headers = None
 
     stream = False
+    # whether a later reply matching the same requests takes over after this
+    # one was served once
+    consumable = True
 
-    def __init__(self, method, url, match_querystring=False):
+    def __init__(
+        self,
+        method,
+        url,
+        match_querystring=False,
+        latency=None,
+        rate_limit=None,
+        bandwidth=None,
+    ):
         self.method = method
         self.match_querystring = match_querystring
+        self.latency = _as_latency(latency)
+        self.bandwidth = _as_bandwidth(bandwidth)
+        # (calls, period): at most ``calls`` responses per ``period`` seconds
+        self.rate_limit = rate_limit
+        self._hits = deque()
         # ensure the url has a default path set if the url is a string
         self.url = _ensure_url_default_path(url)
         self.call_count = 0
 
+    @property
+    def url(self):
+        return self._url
+
+    @url.setter
+    def url(self, url):
+        self._url = url
+        self._compiled_url = _compile_url(url)
+
     def __eq__(self, other):
         if not isinstance(other, BaseReply):
             return False
@@ -59,42 +96,26 @@ class BaseReply(object):
         return not self.__eq__(other)
 
     def _url_matches_strict(self, url, other):
-        url_parsed = urlparse(url)
-        other_parsed = urlparse(other)
-
-        if url_parsed[:3] != other_parsed[:3]:
-            return False
-
-        url_qsl = sorted(parse_qsl(url_parsed.query))
-        other_qsl = sorted(parse_qsl(other_parsed.query))
-
-        if len(url_qsl) != len(other_qsl):
-            return False
-
-        for (a_k, a_v), (b_k, b_v) in zip(url_qsl, other_qsl):
-            if a_k != b_k:
-                return False
+        if not isinstance(url, RegisteredURL):
+            url = _compile_url(url)
+        if not isinstance(other, RequestURL):
+            other = _request_url(other)
 
-            if a_v != b_v:
-                return False
-
-        return True
+        return url.parts == other.parts and url.query == other.query
 
     def _url_matches(self, url, other, match_querystring=False):
+        if not isinstance(other, RequestURL):
+            other = _request_url(other)
+
         if _is_string(url):
-            if _has_unicode(url):
-                url = _clean_unicode(url)
-                if not isinstance(other, six.text_type):
-                    other = other.encode("ascii").decode("utf8")
+            compiled = self._compiled_url if url is self.url else _compile_url(url)
             if match_querystring:
-                return self._url_matches_strict(url, other)
+                return self._url_matches_strict(compiled, other)
 
             else:
-                url_without_qs = url.split("?", 1)[0]
-                other_without_qs = other.split("?", 1)[0]
-                return url_without_qs == other_without_qs
+                return compiled.without_qs == other.without_qs
 
-        elif isinstance(url, Pattern) and url.match(other):
+        elif isinstance(url, Pattern) and url.match(other.raw):
             return True
 
         else:
@@ -108,14 +129,40 @@ class BaseReply(object):
             headers.update(self.headers)
         return headers
 
-    def get_response(self, request):
+    def retry_after(self, now):
+        """
+        Registers a hit at time ``now`` against the rate limit. Returns 0 when
+        the hit is allowed, otherwise the seconds until the next one would be.
+        """
+        if self.rate_limit is None:
+            return 0
+        calls, period = self.rate_limit
+        while self._hits and self._hits[0] <= now - period:
+            self._hits.popleft()
+        if len(self._hits) >= calls:
+            return self._hits[0] + period - now
+        self._hits.append(now)
+        return 0
+
+    async def get_rate_limited_response(self, request, retry_after):
+        headers = {"Retry-After": str(int(math.ceil(retry_after)))}
+        return await build_response(request, 429, headers, BytesIO())
+
+    async def get_response(self, request):
         raise NotImplementedError
 
-    def matches(self, request):
+    def matches(self, request, url=None):
+        """
+        ``url`` is the ``RequestURL`` of ``request``, when the caller already
+        built it.
+        """
         if request.method != self.method:
             return False
 
-        if not self._url_matches(self.url, request.url, self.match_querystring):
+        if url is None:
+            url = _request_url(request.url)
+
+        if not self._url_matches(self.url, url, self.match_querystring):
             return False
 
         return True
@@ -132,22 +179,42 @@ class Reply(BaseReply):
         headers=None,
         stream=False,
         content_type=UNSET,
+        body_file=None,
+        frozen=False,
         **kwargs
     ):
-        # if we were passed a `json` argument,
-        # override the body and content_type
+        # if we were passed a `json` argument, override the content_type,
+        # the body is only encoded when the reply is first served
+        self.json = json
         if json is not None:
             assert not body
-            body = json_module.dumps(json)
+            body = UNSET
             if content_type is UNSET:
                 content_type = "application/json"
 
         if content_type is UNSET:
             content_type = "text/plain"
 
-        # body must be bytes
-        if isinstance(body, six.text_type):
+        # body must be bytes, encoded and frozen once for every request
+        if isinstance(body, str):
             body = body.encode("utf-8")
+        elif isinstance(body, (bytearray, memoryview)):
+            body = bytes(body)
+
+        # file bodies are mapped in memory once, every request reads its own
+        # view of the mapping instead of consuming a shared file handle
+        self.content_length = None
+        if body_file is not None:
+            assert not body
+            with open(body_file, "rb") as f:
+                body = _map_file(f)
+                if body is f:
+                    # the handle is closed with the block, read it now
+                    body = f.read()
+        elif isinstance(body, _io.BufferedReader):
+            body = _map_file(body)
+        if body_file is not None or isinstance(body, (mmap.mmap, memoryview)):
+            self.content_length = len(body)
 
         self.body = body
         self.status = status
@@ -156,20 +223,43 @@ class Reply(BaseReply):
         self.content_type = content_type
         super(Reply, self).__init__(method, url, **kwargs)
 
-    def get_response(self, request):
-        if self.body and isinstance(self.body, Exception):
+        # frozen replies compute their headers, reason phrase and cookies at
+        # registration, later changes to the reply are not picked up
+        self.frozen = frozen
+        self._template = None
+        if frozen:
+            self._template = ResponseTemplate(self.status, self.get_headers())
+
+    @property
+    def body(self):
+        if self._body is UNSET:
+            self._body = _json_dumps(self.json)
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+
+    def get_headers(self):
+        headers = super(Reply, self).get_headers()
+        if self.content_length is not None:
+            headers.setdefault("Content-Length", str(self.content_length))
+        return headers
+
+    async def get_response(self, request):
+        if isinstance(self.body, Exception):
             raise self.body
 
+        if self._template is not None:
+            return await self._template.build(
+                request, _handle_body(self.body), stream=self.stream
+            )
+
         headers = self.get_headers()
-        status = self.status
         body = _handle_body(self.body)
 
-        return HTTPResponse(
-            status=status,
-            reason=six.moves.http_client.responses.get(status),
-            body=body,
-            headers=headers,
-            preload_content=False,
+        return await build_response(
+            request, self.status, headers, body, stream=self.stream
         )
 
 
@@ -182,10 +272,10 @@ class CallbackReply(BaseReply):
         self.content_type = content_type
         super(CallbackReply, self).__init__(method, url, **kwargs)
 
-    def get_response(self, request):
+    async def get_response(self, request):
         headers = self.get_headers()
 
-        result = self.callback(request)
+        result = await _maybe_await(self.callback(request))
         if isinstance(result, Exception):
             raise result
 
@@ -193,10 +283,56 @@ class CallbackReply(BaseReply):
         body = _handle_body(body)
         headers.update(r_headers)
 
-        return HTTPResponse(
-            status=status,
-            reason=six.moves.http_client.responses.get(status),
-            body=body,
-            headers=headers,
-            preload_content=False,
-        )
+        return await build_response(request, status, headers, body, stream=self.stream)
+
+
+class SequenceReply(BaseReply):
+    """
+    Serves a scripted sequence of replies, one per matching request, in
+    order. Once each reply was served, ``policy`` decides what comes next:
+    ``"repeat_last"`` keeps serving the last one, ``"cycle"`` starts over
+    and ``"exhaust"`` stops matching, letting later replies answer.
+    """
+
+    consumable = False
+    POLICIES = ("repeat_last", "cycle", "exhaust")
+
+    def __init__(self, method, url, replies, policy="repeat_last", **kwargs):
+        if policy not in self.POLICIES:
+            raise ValueError(
+                "Unknown policy {0!r}, expected one of {1}".format(policy, self.POLICIES)
+            )
+        self.replies = deque(replies)
+        self.policy = policy
+        self._lock = threading.Lock()
+        super(SequenceReply, self).__init__(method, url, **kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def matches(self, request, url=None):
+        return bool(self.replies) and super(SequenceReply, self).matches(request, url)
+
+    def next_reply(self):
+        """
+        Returns the reply serving the next request and counts the call, None
+        once exhausted.
+        """
+        with self._lock:
+            if not self.replies:
+                return None
+            if self.policy == "cycle":
+                reply = self.replies[0]
+                self.replies.rotate(-1)
+            elif self.policy == "repeat_last" and len(self.replies) == 1:
+                reply = self.replies[0]
+            else:
+                reply = self.replies.popleft()
+            self.call_count += 1
+            return reply
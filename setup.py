@@ -19,7 +19,7 @@ setup_requires = []
 if "test" in sys.argv:
     setup_requires.append("pytest")
 
-install_requires = ["asks", "cookies"]
+install_requires = ["asks", "cookies", "sniffio"]
 
 tests_require = [
     "pytest",
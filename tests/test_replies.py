@@ -1,12 +1,21 @@
 # coding: utf-8
 
+import json
+import os
+import pickle
 import re
+import socket
+import subprocess
+import sys
+import time
 import asks
+import multio
 import replies
 import pytest
 from replies import BaseReply, Reply
 
 from inspect import getargspec
+from types import SimpleNamespace
 from asks.errors import ConnectivityError, BadHttpResponse
 
 
@@ -17,7 +26,7 @@ def assert_reset():
 
 def assert_response(resp, body=None, content_type="text/plain"):
     assert resp.status_code == 200
-    assert resp.reason == "OK"
+    assert resp.reason_phrase == "OK"
     if content_type is not None:
         assert resp.headers["Content-Type"] == content_type
     else:
@@ -174,6 +183,26 @@ def test_response_equality(args1, kwargs1, args2, kwargs2, expected):
     assert (o1 != o2) is not expected
 
 
+@pytest.mark.parametrize(
+    "url,other,match_querystring,expected",
+    [
+        ("http://example.com/a?x=1&y=2", "http://example.com/a?y=2&x=1", True, True),
+        ("http://example.com/a?x=1&x=2", "http://example.com/a?x=2&x=1", True, True),
+        ("http://example.com/a?x=1&x=1", "http://example.com/a?x=1", True, False),
+        ("http://example.com/a?x=1", "http://example.com/a?x=2", False, True),
+        ("http://example.com/a", "http://example.com/b", False, False),
+        ("http://example.com/a?q=汉字", "http://example.com/a?q=汉字", True, True),
+        ("http://www.संजाल.भारत/hi", "http://www.संजाल.भारत/hi?q=1", False, True),
+    ],
+)
+def test_response_url_matches(url, other, match_querystring, expected):
+    o = BaseReply(replies.GET, url, match_querystring=match_querystring)
+    assert o._url_matches(o.url, other, match_querystring) is expected
+
+    o.url = other
+    assert o._url_matches(o.url, other, match_querystring) is True
+
+
 def test_response_equality_different_objects():
     o1 = BaseReply(method=replies.GET, url="a")
     o2 = "str"
@@ -342,6 +371,48 @@ async def test_accept_json_body(asynclib):
     assert_reset()
 
 
+@pytest.mark.asyncio
+async def test_json_codec(asynclib):
+    class Codec(object):
+        def __init__(self):
+            self.dumped = []
+
+        def dumps(self, obj):
+            self.dumped.append(obj)
+            return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+        def loads(self, data):
+            return json.loads(data)
+
+    codec = Codec()
+
+    @replies.activate
+    async def run():
+        replies.add(replies.GET, "http://example.com/", json={"a": [1, 2]})
+        replies.add(replies.GET, "http://example.com/unused", json={"b": 1})
+        replies.add_callback(
+            replies.POST,
+            "http://example.com/",
+            lambda request: (200, {}, str(request.json()["x"])),
+        )
+        assert codec.dumped == []
+
+        for _ in range(2):
+            resp = await asks.get("http://example.com/")
+            assert_response(resp, '{"a":[1,2]}', "application/json")
+        assert codec.dumped == [{"a": [1, 2]}]
+
+        resp = await asks.post("http://example.com/", json={"x": 42})
+        assert_response(resp, "42")
+
+    assert replies.set_json_codec(codec) is codec
+    try:
+        await run()
+    finally:
+        assert replies.set_json_codec("not_a_json_module") is json
+    assert_reset()
+
+
 @pytest.mark.asyncio
 async def test_no_content_type(asynclib):
     @replies.activate
@@ -360,10 +431,27 @@ async def test_arbitrary_status_code(asynclib):
     @replies.activate
     async def run():
         url = "http://example.com/"
-        replies.add(replies.GET, url, body="test", status=418)
+        replies.add(replies.GET, url, body="test", status=599)
         resp = await asks.get(url)
-        assert resp.status_code == 418
-        assert resp.reason is None
+        assert resp.status_code == 599
+        assert resp.reason_phrase is None
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_request_encoding(asynclib):
+    @replies.activate
+    async def run():
+        url = "http://example.com/"
+        replies.add(replies.POST, url, body="test")
+        resp = await asks.post(url, data="caf\xe9", encoding="latin-1")
+        assert resp.encoding == "latin-1"
+        assert replies.calls[0].request.body == b"caf\xe9"
+
+        await asks.post(url, data="caf\xe9")
+        assert replies.calls[1].request.body == "caf\xe9".encode("utf-8")
 
     await run()
     assert_reset()
@@ -403,7 +491,7 @@ async def test_callback(asynclib):
         resp = await asks.get(url)
         assert resp.text == "test callback"
         assert resp.status_code == status
-        assert resp.reason == reason
+        assert resp.reason_phrase == reason
         assert "foo" in resp.headers
         assert resp.headers["foo"] == "bar"
 
@@ -411,6 +499,452 @@ async def test_callback(asynclib):
     assert_reset()
 
 
+def test_async_callback(asynclib):
+    url = "http://example.com/"
+
+    async def request_callback(request):
+        await multio.asynclib.sleep(0.2)
+        return (200, {}, request.url)
+
+    async def response_callback(resp):
+        resp._is_mocked = True
+        return resp
+
+    async def fetch(i, results):
+        results[i] = await asks.get(url, params={"i": i})
+
+    async def run():
+        with replies.AsksMock(response_callback=response_callback) as m:
+            m.add_callback(replies.GET, url, request_callback)
+            results = {}
+            start = time.monotonic()
+            async with multio.asynclib.task_manager() as tm:
+                for i in range(100):
+                    await multio.asynclib.spawn(tm, fetch, i, results)
+            # the callbacks ran concurrently, not one after the other
+            assert time.monotonic() - start < 2
+            assert len(m.calls) == 100
+            assert results[42].text == "http://example.com/?i=42"
+            assert all(resp._is_mocked for resp in results.values())
+
+            # the callback runs under the request timeout
+            start = time.monotonic()
+            with pytest.raises(asks.errors.RequestTimeout):
+                await asks.get(url, timeout=0.05)
+            assert time.monotonic() - start < 0.2
+
+    multio.run(run)
+    assert_reset()
+
+
+def test_concurrent_threads(asynclib):
+    import threading
+
+    threads, tasks = 4, 50
+    served = []
+
+    async def fetch():
+        resp = await asks.get("http://example.com/seq")
+        served.append(resp.text)
+        await asks.get("http://example.com/hits")
+
+    async def spawn_all():
+        async with multio.asynclib.task_manager() as tm:
+            for _ in range(tasks):
+                await multio.asynclib.spawn(tm, fetch)
+
+    lib_name = asynclib.lib_name
+    errors = []
+
+    def worker():
+        # multio keeps its event loop library per thread
+        multio.init(lib_name)
+        try:
+            multio.run(spawn_all)
+        except Exception as e:
+            errors.append(e)
+
+    with replies.AsksMock() as m:
+        for i in range(threads * tasks):
+            m.add(replies.GET, "http://example.com/seq", body=str(i))
+        m.add(replies.GET, "http://example.com/hits", rate_limit=(100, 3600))
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        assert errors == []
+
+        # every sequenced reply was served exactly once
+        assert sorted(served, key=int) == [str(i) for i in range(threads * tasks)]
+        assert len(m.calls) == m.calls.total == 2 * threads * tasks
+        assert m.calls.counters["GET", 429] == threads * tasks - 100
+        assert sum(reply.call_count for reply in m._matches) == threads * tasks + 1
+
+
+def test_latency(asynclib):
+    url = "http://example.com/"
+
+    async def fetch(results):
+        results.append(await asks.get(url))
+
+    async def run():
+        with replies.AsksMock() as m:
+            m.add(replies.GET, url, body="slow", latency=0.2)
+            results = []
+            start = time.monotonic()
+            async with multio.asynclib.task_manager() as tm:
+                for _ in range(100):
+                    await multio.asynclib.spawn(tm, fetch, results)
+            elapsed = time.monotonic() - start
+            assert 0.2 <= elapsed < 2
+            assert len(results) == 100
+            assert_response(results[0], "slow")
+
+    multio.run(run)
+    assert_reset()
+
+
+def _run_without_multio(main):
+    """
+    Runs the ``main`` coroutine function source under plain trio, with a
+    ``MockClock``, then curio, and returns what it printed.
+    """
+    script = (
+        "import asks, curio, trio, trio.testing, replies\n"
+        + main
+        + "runs = ((trio.run, 'curio', {'clock': trio.testing.MockClock(autojump_threshold=0)}),\n"
+        "        (curio.run, 'trio', {}))\n"
+        "for run, other, kwargs in runs:\n"
+        "    if hasattr(asks, 'init'):\n"
+        "        # asks 2 builds its sessions through multio: set it up for the\n"
+        "        # other library, only replies' own sleeps follow the running one\n"
+        "        asks.init(other)\n"
+        "    run(main, **kwargs)\n"
+    )
+    return subprocess.check_output([sys.executable, "-c", script], universal_newlines=True)
+
+
+def test_latency_without_multio():
+    # replies sleeps in whatever library runs the request
+    output = _run_without_multio(
+        "async def main():\n"
+        "    with replies.AsksMock() as m:\n"
+        "        m.add(replies.GET, 'http://example.com/', body='slow', latency=0.01)\n"
+        "        print((await asks.get('http://example.com/')).text)\n"
+    )
+    assert output.split() == ["slow", "slow"]
+
+
+def test_virtual_time_without_multio():
+    output = _run_without_multio(
+        "async def main():\n"
+        "    with replies.AsksMock(virtual_time=True) as m:\n"
+        "        m.add(replies.GET, 'http://example.com/', body='late', latency=3600)\n"
+        "        start = m.clock.now()\n"
+        "        resp = await asks.get('http://example.com/')\n"
+        "        print(resp.text, type(m.clock).__name__, m.clock.now() - start)\n"
+    )
+    assert output.split() == ["late", "TrioClock", "3600.0", "late", "VirtualClock", "3600.0"]
+
+
+async def _check_virtual_time():
+    order = []
+
+    async def fetch(path):
+        resp = await asks.get("http://example.com/" + path)
+        order.append(resp.text)
+
+    async def run():
+        with replies.AsksMock(virtual_time=True) as m:
+            m.add(replies.GET, "http://example.com/hour", body="hour", latency=3600)
+            m.add(replies.GET, "http://example.com/day", body="day", latency=86400)
+            m.add(replies.GET, "http://example.com/now", body="now")
+            start = time.monotonic()
+            virtual_start = m.clock.now()
+            async with multio.asynclib.task_manager() as tm:
+                await multio.asynclib.spawn(tm, fetch, "day")
+                await multio.asynclib.spawn(tm, fetch, "hour")
+                await multio.asynclib.spawn(tm, fetch, "now")
+            assert order == ["now", "hour", "day"]
+            assert m.clock.now() - virtual_start == pytest.approx(86400)
+            assert time.monotonic() - start < 1
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.trio
+async def test_virtual_time_mock_clock(asynclib, autojump_clock):
+    # trio's mock clock only exists under trio
+    if asynclib.lib_name != "trio":
+        pytest.skip("trio only")
+    await _check_virtual_time()
+
+
+def test_virtual_time(asynclib):
+    multio.run(_check_virtual_time)
+
+
+def test_timeout_and_rate_limit(asynclib):
+    async def run():
+        with replies.AsksMock(virtual_time=True) as m:
+            m.add(replies.GET, "http://example.com/slow", latency=60)
+            with pytest.raises(asks.errors.RequestTimeout):
+                await asks.get("http://example.com/slow", timeout=30)
+            assert m.clock.now() == pytest.approx(30)
+            assert isinstance(m.calls[0].response, asks.errors.RequestTimeout)
+
+            m.add(replies.GET, "http://example.com/limited", rate_limit=(2, 10))
+            statuses = []
+            for _ in range(3):
+                resp = await asks.get("http://example.com/limited")
+                statuses.append(resp.status_code)
+            assert statuses == [200, 200, 429]
+            assert resp.headers["Retry-After"] == "10"
+
+            await m.clock.sleep(10)
+            resp = await asks.get("http://example.com/limited")
+            assert resp.status_code == 200
+
+            # bandwidth and callbacks count towards the timeout too
+            async def slow_callback(request):
+                await m.clock.sleep(5)
+                return (200, {}, "late")
+
+            m.add(replies.GET, "http://example.com/big", body=b"x" * 10000, bandwidth=1000)
+            m.add_callback(replies.GET, "http://example.com/callback", slow_callback)
+            for url, timeout in (("big", 0.5), ("callback", 0.1)):
+                start = m.clock.now()
+                with pytest.raises(asks.errors.RequestTimeout):
+                    await asks.get("http://example.com/" + url, timeout=timeout)
+                assert m.clock.now() - start == pytest.approx(timeout)
+            start = m.clock.now()
+            resp = await asks.get("http://example.com/big", timeout=20)
+            assert len(resp.content) == 10000
+            assert m.clock.now() - start == pytest.approx(10)
+
+            # streamed bodies time out per read
+            m.add(
+                replies.GET,
+                "http://example.com/stream",
+                body=b"x" * 10000,
+                stream=True,
+                bandwidth=replies.latency.Bandwidth(1000, chunk_size=1000),
+            )
+            resp = await asks.get("http://example.com/stream", timeout=0.5)
+            async with resp.body(timeout=2) as body:
+                assert len([chunk async for chunk in body]) == 10
+            resp = await asks.get("http://example.com/stream", timeout=0.5)
+            with pytest.raises(asks.errors.RequestTimeout):
+                async with resp.body(timeout=0.5) as body:
+                    async for chunk in body:
+                        pass
+
+    multio.run(run)
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_call_retention(asynclib):
+    async def drive(calls, check):
+        with replies.AsksMock(calls=calls) as m:
+            m.add(replies.GET, "http://example.com/ok")
+            m.add(replies.POST, "http://example.com/ko", status=500)
+            for i in range(10):
+                await asks.get("http://example.com/ok?i={0}".format(i))
+            await asks.post("http://example.com/ko", data="payload")
+            with pytest.raises(ConnectionError):
+                await asks.get("http://example.com/missing")
+            assert m.calls is calls
+            assert calls.total == 12
+            assert calls.counters == {
+                ("GET", 200): 10,
+                ("POST", 500): 1,
+                ("GET", "ConnectionError"): 1,
+            }
+            check(calls)
+        assert calls.total == 0 and not calls.counters and len(calls) == 0
+
+    def last_three(calls):
+        assert len(calls) == 3
+        assert calls[0].request.url == "http://example.com/ok?i=9"
+        assert [call.request.method for call in calls[1:]] == ["POST", "GET"]
+
+    def sampled(calls):
+        assert [call.request.url[-3:] for call in calls] == ["i=0", "i=5", "/ko"]
+
+    def fingerprints(calls):
+        assert calls[0] == replies.Fingerprint(
+            "POST", "http://example.com/ko", 500, calls[0].body_digest
+        )
+        assert len(calls[0].body_digest) == 16
+        assert calls[1].status == "ConnectionError"
+        assert calls[1].body_digest is None
+
+    def counters(calls):
+        assert len(calls) == 0
+        with pytest.raises(IndexError):
+            calls[0]
+
+    await drive(replies.CallList(maxlen=3), last_three)
+    await drive(replies.CallList(sample=5), sampled)
+    await drive(replies.CallList(store="fingerprints", maxlen=2), fingerprints)
+    await drive(replies.CallList(store="counters"), counters)
+    with pytest.raises(ValueError):
+        replies.CallList(store="everything")
+    for store in ("counters", "columns", replies.ColumnStore()):
+        with pytest.raises(ValueError):
+            replies.CallList(store=store, maxlen=10)
+
+
+def test_call_journal(asynclib, tmpdir):
+    async def run():
+        path = str(tmpdir.join("calls.jsonl"))
+        store = replies.JournalStore(path, headers=("X-Run",))
+        calls = replies.CallList(store=store)
+        with replies.AsksMock(calls=calls, virtual_time=True) as m:
+            m.add(replies.POST, "http://example.com/", latency=2)
+            for i in range(3):
+                await asks.post(
+                    "http://example.com/", data="body", headers={"X-Run": str(i)}
+                )
+            with pytest.raises(ConnectionError):
+                await asks.get("http://example.com/missing")
+
+            assert len(calls) == 4
+            entry = calls[1]
+            assert isinstance(entry, replies.JournalEntry)
+            assert entry[1:] == (
+                "POST",
+                "http://example.com/",
+                {"X-Run": "1"},
+                entry.body_digest,
+                200,
+                2,
+            )
+            assert calls[-1].status == "ConnectionError"
+            assert [e.headers for e in calls[:2]] == [{"X-Run": "0"}, {"X-Run": "1"}]
+            assert [e.elapsed for e in calls] == [2, 2, 2, 0]
+
+        # the file keeps the calls made before the reset
+        with replies.AsksMock(calls=calls) as m:
+            m.add(replies.GET, "http://example.com/")
+            await asks.get("http://example.com/")
+            assert [e.method for e in calls] == ["GET"]
+        store.close()
+        assert len(list(replies.read_journal(path))) == 5
+
+    multio.run(run)
+
+
+def test_call_columns(asynclib):
+    async def run():
+        calls = replies.CallList(store="columns")
+        with replies.AsksMock(calls=calls, virtual_time=True) as m:
+            m.add(replies.GET, "http://a.com/ok", body="12345", latency=1)
+            m.add(replies.GET, "http://a.com/ko", status=503, latency=3)
+            m.add(replies.GET, "http://b.com/ko", status=500, latency=10)
+            for i in range(4):
+                await asks.get("http://a.com/ok")
+            for i in range(2):
+                await asks.get("http://a.com/ko")
+            await asks.get("http://b.com/ko")
+            with pytest.raises(ConnectionError):
+                await asks.get("http://b.com/missing")
+
+            store = calls.store
+            assert len(calls) == 8
+            assert calls[0][1:] == ("GET", "http://a.com/ok", "a.com", 200, 5, 1)
+            assert calls[-1].status == "ConnectionError"
+            assert calls[-1].size == -1
+
+            assert store.count(status=range(500, 600)) == 3
+            assert store.count(url="http://a.com/ko", status=range(500, 600)) == 2
+            assert store.count(status="ConnectionError", host="b.com") == 1
+            assert store.count(url="http://nowhere.com/") == 0
+            assert store.group_count("host") == {"a.com": 6, "b.com": 2}
+            assert store.group_count("status", host="a.com") == {200: 4, 503: 2}
+            assert store.percentile("elapsed", 50) == pytest.approx(1)
+            assert store.percentile("elapsed", 100, by="host") == {
+                "a.com": pytest.approx(3),
+                "b.com": pytest.approx(10),
+            }
+            assert store.column("url")[-2] == "http://b.com/ko"
+        assert len(calls) == 0
+
+    multio.run(run)
+
+
+def test_bandwidth(asynclib):
+    async def run():
+        with replies.AsksMock(virtual_time=True) as m:
+            m.add(replies.GET, "http://example.com/flat", body=b"x" * 1000, bandwidth=100)
+            m.add(
+                replies.GET,
+                "http://example.com/stream",
+                body=b"x" * 1000,
+                stream=True,
+                bandwidth=replies.latency.Bandwidth(100, chunk_size=250, first_byte=2),
+            )
+
+            resp = await asks.get("http://example.com/flat")
+            assert resp.content == b"x" * 1000
+            assert m.clock.now() == pytest.approx(10)
+
+            resp = await asks.get("http://example.com/stream")
+            start = m.clock.now()
+            received = []
+            async with resp.body() as body:
+                async for chunk in body:
+                    received.append((len(chunk), m.clock.now() - start))
+            assert received == [
+                (250, pytest.approx(4.5)),
+                (250, pytest.approx(7)),
+                (250, pytest.approx(9.5)),
+                (250, pytest.approx(12)),
+            ]
+
+    multio.run(run)
+    assert_reset()
+
+    with pytest.raises(ValueError):
+        replies.latency.Bandwidth(0)
+    with pytest.raises(TypeError):
+        replies.Reply(replies.GET, "http://example.com", bandwidth="fast")
+
+
+@pytest.mark.parametrize(
+    "factory",
+    [
+        lambda seed: replies.latency.Uniform(0.1, 0.5, seed=seed),
+        lambda seed: replies.latency.Normal(0.2, 0.1, seed=seed),
+        lambda seed: replies.latency.LogNormal(0.1, 0.5, seed=seed),
+        lambda seed: replies.latency.Percentiles({50: 0.1, 90: 0.3, 99: 1}, seed=seed),
+    ],
+)
+def test_latency_distributions(factory):
+    samples = [factory(42).sample() for _ in range(3)]
+    assert samples[0] == samples[1] == samples[2]
+
+    latency = factory(42)
+    samples = [latency.sample() for _ in range(1000)]
+    assert all(delay >= 0 for delay in samples)
+    assert len(set(samples)) > 1
+
+
+def test_latency_percentiles():
+    latency = replies.latency.Percentiles({0: 0.1, 50: 0.2, 100: 0.4}, seed=1)
+    samples = sorted(latency.sample() for _ in range(10000))
+    assert 0.1 <= samples[0] and samples[-1] <= 0.4
+    assert samples[5000] == pytest.approx(0.2, abs=0.01)
+
+    with pytest.raises(ValueError):
+        replies.latency.Percentiles({})
+    with pytest.raises(TypeError):
+        Reply(replies.GET, url="http://example.com", latency="slow")
+
+
 def test_callback_no_content_type():
     body = b"test callback"
     status = 400
@@ -427,7 +961,7 @@ def test_callback_no_content_type():
         resp = asks.get(url)
         assert resp.text == "test callback"
         assert resp.status_code == status
-        assert resp.reason == reason
+        assert resp.reason_phrase == reason
         assert "foo" in resp.headers
         assert "Content-Type" not in resp.headers
 
@@ -546,10 +1080,56 @@ async def test_response_cookies():
         resp = await asks.get(url)
         assert resp.text == "test callback"
         assert resp.status_code == status
-        assert "session_id" in resp.cookies
-        assert resp.cookies["session_id"] == "12345"
-        assert resp.cookies["a"] == "b"
-        assert resp.cookies["c"] == "d"
+        cookies = {cookie.name: cookie.value for cookie in resp.cookies}
+        assert cookies == {"session_id": "12345", "a": "b", "c": "d"}
+        assert all(cookie.host == "example.com" for cookie in resp.cookies)
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_frozen_reply():
+    @replies.activate
+    async def run():
+        reply = replies.Reply(
+            replies.GET,
+            "http://example.com/",
+            body="frozen",
+            headers={"set-cookie": "session_id=12345", "X-Test": "1"},
+            frozen=True,
+        )
+        replies.add(reply)
+        first = await asks.get("http://example.com/")
+        second = await asks.get("http://example.com/")
+        for resp in (first, second):
+            assert_response(resp, "frozen")
+            assert resp.headers["x-test"] == "1"
+            assert [(c.name, c.value, c.host) for c in resp.cookies] == [
+                ("session_id", "12345", "example.com")
+            ]
+
+        # every response gets its own headers and cookies
+        first.headers["X-Injected"] = "yes"
+        first.cookies.clear()
+        third = await asks.get("http://example.com/")
+        assert "x-injected" not in third.headers
+        assert len(third.cookies) == 1
+
+        # the template is built at registration, later changes are ignored
+        reply.headers["X-Test"] = "2"
+        resp = await asks.get("http://example.com/")
+        assert resp.headers["x-test"] == "1"
+
+        def chunks():
+            yield b"fro"
+            yield b"zen"
+
+        replies.add(replies.GET, "http://example.com/lazy", body=chunks, frozen=True)
+        for _ in range(2):
+            resp = await asks.get("http://example.com/lazy")
+            assert_response(resp, "frozen")
+            assert resp.headers["transfer-encoding"] == "chunked"
 
     await run()
     assert_reset()
@@ -591,6 +1171,107 @@ async def test_response_filebody():
     #assert_reset()
 
 
+@pytest.mark.asyncio
+async def test_response_lazy_body(asynclib):
+    produced = []
+
+    async def endless():
+        i = 0
+        while True:
+            produced.append(i)
+            yield "event {0}\n".format(i)
+            i += 1
+
+    def lines():
+        yield b"one\n"
+        yield "two\n"
+
+    @replies.activate
+    async def run():
+        replies.add(replies.GET, "http://example.com/events", body=endless(), stream=True)
+        replies.add(replies.GET, "http://example.com/lines", body=lines)
+
+        resp = await asks.get("http://example.com/events")
+        assert resp.headers["Transfer-Encoding"] == "chunked"
+        assert "Content-Length" not in resp.headers
+        chunks = []
+        async with resp.body as content:
+            async for chunk in content:
+                chunks.append(chunk)
+                if len(chunks) == 5:
+                    break
+        assert chunks[-1] == b"event 4\n"
+        assert len(produced) == 5
+
+        for _ in range(2):
+            resp = await asks.get("http://example.com/lines")
+            assert resp.content == b"one\ntwo\n"
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_response_body_file(asynclib, tmpdir):
+    path = tmpdir.join("download.bin")
+    path.write_binary(bytes(range(256)) * 1000)
+
+    @replies.activate
+    async def run():
+        replies.add(replies.GET, "http://example.com", body_file=str(path), stream=True)
+        with open(str(path), "rb") as out:
+            out.seek(256)
+            replies.add(replies.GET, "http://example.com/rest", body=out)
+
+        for _ in range(3):
+            resp = await asks.get("http://example.com")
+            assert resp.headers["Content-Length"] == "256000"
+            content = b"".join([chunk async for chunk in resp.body])
+            assert content == path.read_binary()
+
+        for _ in range(2):
+            resp = await asks.get("http://example.com/rest")
+            assert resp.content == path.read_binary()[256:]
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_response_body_file_empty(asynclib, tmpdir):
+    path = tmpdir.join("empty.bin")
+    path.write_binary(b"")
+    with replies.AsksMock() as m:
+        m.add(replies.GET, "http://example.com", body_file=str(path))
+        resp = await asks.get("http://example.com")
+        assert resp.headers["Content-Length"] == "0"
+        assert resp.content == b""
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+@pytest.mark.asyncio
+async def test_response_body_file_unmappable(asynclib, tmpdir):
+    import threading
+
+    # a named pipe cannot be mapped, it is read when the reply is added
+    path = str(tmpdir.join("pipe"))
+    os.mkfifo(path)
+
+    def write():
+        with open(path, "wb") as f:
+            f.write(b"piped")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with replies.AsksMock() as m:
+        m.add(replies.GET, "http://example.com", body_file=path)
+        writer.join()
+        for _ in range(2):
+            resp = await asks.get("http://example.com")
+            assert resp.content == b"piped"
+            assert resp.headers["Content-Length"] == "5"
+
+
 @pytest.mark.asyncio
 async def test_assert_all_asks_are_fired():
     async def run():
@@ -655,7 +1336,7 @@ async def test_allow_redirects_samehost():
         # setup redirect
         with replies.mock:
             replies.add_callback(replies.GET, url_re, request_callback)
-            resp_no_redirects = await asks.get(redirecting_url, allow_redirects=False)
+            resp_no_redirects = await asks.get(redirecting_url, follow_redirects=False)
             assert resp_no_redirects.status_code == 301
             assert len(replies.calls) == 1  # 1x300
             assert replies.calls[0][1].status_code == 301
@@ -663,7 +1344,7 @@ async def test_allow_redirects_samehost():
 
         with replies.mock:
             replies.add_callback(replies.GET, url_re, request_callback)
-            resp_yes_redirects = await asks.get(redirecting_url, allow_redirects=True)
+            resp_yes_redirects = await asks.get(redirecting_url, follow_redirects=True)
             assert len(replies.calls) == 3  # 2x300 + 1x200
             assert len(resp_yes_redirects.history) == 2
             assert resp_yes_redirects.status_code == 200
@@ -758,6 +1439,164 @@ async def test_multiple_replies(asynclib):
     assert_reset()
 
 
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        ("repeat_last", ["a", "b", "c", "c", "c"]),
+        ("cycle", ["a", "b", "c", "a", "b"]),
+        ("exhaust", ["a", "b", "c", "fallback", "fallback"]),
+    ],
+)
+async def test_sequence(asynclib, policy, expected):
+    url = "http://example.com/job"
+    # the fallback is only reached once the sequence is exhausted
+    with replies.AsksMock(assert_all_requests_are_fired=False) as m:
+        m.add_sequence(
+            replies.GET,
+            url,
+            [{"body": "a"}, Reply(replies.GET, url, body="b"), {"body": "c"}],
+            policy=policy,
+        )
+        m.add(replies.GET, url, body="fallback")
+        served = [(await asks.get(url)).text for _ in range(5)]
+        assert served == expected
+        assert len(m.calls) == 5
+
+    with pytest.raises(ValueError):
+        replies.SequenceReply(replies.GET, url, [], policy="shuffle")
+
+
+@pytest.mark.asyncio
+async def test_sequence_after_reply(asynclib):
+    url = "http://example.com/job"
+    with replies.AsksMock() as m:
+        m.add(replies.GET, url, body="plain")
+        m.add_sequence(replies.GET, url, [{"body": "a"}, {"body": "b"}])
+        # the reply registered first is served first
+        served = [(await asks.get(url)).text for _ in range(4)]
+        assert served == ["plain", "a", "b", "b"]
+
+
+def test_sequence_exhaust_threads(asynclib):
+    import threading
+
+    threads, tasks = 4, 50
+    url = "http://example.com/job"
+    served = []
+
+    async def fetch():
+        served.append((await asks.get(url)).text)
+
+    async def spawn_all():
+        async with multio.asynclib.task_manager() as tm:
+            for _ in range(tasks):
+                await multio.asynclib.spawn(tm, fetch)
+
+    lib_name = asynclib.lib_name
+    errors = []
+
+    def worker():
+        multio.init(lib_name)
+        try:
+            multio.run(spawn_all)
+        except Exception as e:
+            errors.append(e)
+
+    with replies.AsksMock() as m:
+        steps = [{"body": str(i)} for i in range(threads * tasks // 2)]
+        m.add_sequence(replies.GET, url, steps, policy="exhaust")
+        m.add(replies.GET, url, body="fallback")
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        assert errors == []
+
+    # every step was served once, then the fallback took over
+    assert served.count("fallback") == threads * tasks // 2
+    steps = sorted((s for s in served if s != "fallback"), key=int)
+    assert steps == [str(i) for i in range(threads * tasks // 2)]
+
+
+@pytest.mark.asyncio
+async def test_route_handles(asynclib):
+    with replies.AsksMock(assert_all_requests_are_fired=False) as m:
+        first = m.add(replies.GET, "http://example.com/", body="first")
+        m.add(replies.GET, "http://example.com/", body="second")
+        other = m.add(replies.GET, re.compile(r"http://other\.com/.*"), body="other")
+
+        first.disable()
+        assert_response(await asks.get("http://example.com/"), "second")
+        first.enable()
+        assert_response(await asks.get("http://example.com/"), "first")
+
+        other.replace(Reply(replies.GET, "http://other.com/x", body="replaced"))
+        assert_response(await asks.get("http://other.com/x"), "replaced")
+        other.remove()
+        with pytest.raises(ConnectionError):
+            await asks.get("http://other.com/x")
+        with pytest.raises(ValueError):
+            other.replace(Reply(replies.GET, "http://other.com/x"))
+
+        assert len(m.routes()) == 1
+
+        # a reply moving to other lookups keeps its rank, nothing is rebuilt
+        m._matches._compact = lambda: pytest.fail("lookups rebuilt")
+        ranked = m.add(replies.GET, "http://rank.com/", body="a")
+        m.add(replies.GET, "http://rank.com/", body="b")
+        ranked.replace(Reply(replies.GET, re.compile(r"http://rank\.com/"), body="a2"))
+        assert_response(await asks.get("http://rank.com/"), "a2")
+        assert_response(await asks.get("http://rank.com/"), "b")
+
+        # a regex replacing a regex is filed under its own literal prefix
+        moved = m.add(replies.GET, re.compile(r"http://a\.com/x"), body="x")
+        moved.replace(Reply(replies.GET, re.compile(r"http://b\.com/y"), body="y"))
+        assert_response(await asks.get("http://b.com/y"), "y")
+        with pytest.raises(ConnectionError):
+            await asks.get("http://a.com/x")
+        assert m.routes(host="b.com") == [moved]
+
+    with replies.AsksMock() as m:
+        for i in range(1000):
+            m.add(replies.GET, "http://api.example.com/v1/{0}".format(i))
+            m.add(replies.GET, "http://api.example.com/v2/{0}".format(i))
+        kept = m.add(replies.GET, "http://cdn.example.com/")
+        assert len(m.routes(prefix="http://api.example.com/v1/")) == 1000
+        # prefixes ending inside the host name
+        assert len(m.routes(prefix="http://api.")) == 2000
+        assert len(m.routes(prefix="http://api.ex")) == 2000
+
+        for route in m.routes(host="api.example.com"):
+            route.disable()
+        with pytest.raises(ConnectionError):
+            await asks.get("http://api.example.com/v2/7")
+        for route in m.routes(host="API.example.com"):
+            route.enable()
+        await asks.get("http://api.example.com/v2/7")
+
+        assert len(m.remove_prefix("http://api.example.com/v1/")) == 1000
+        with pytest.raises(ConnectionError):
+            await asks.get("http://api.example.com/v1/7")
+        m.remove_host("api.example.com")
+        assert m.routes() == [kept]
+        await asks.get("http://cdn.example.com/")
+
+        # regex routes go with the host or prefix their literal start holds
+        v3 = m.add(replies.GET, re.compile(r"http://e\.com/v3/\d+"))
+        anywhere = m.add(replies.GET, re.compile(r"http://e\.com/.*"))
+        unknown = m.add(replies.GET, re.compile(r"http://e\.(com|org)/$"))
+        assert m.routes(prefix="http://e.com/v3/") == [v3]
+        assert m.routes(prefix="http://e.") == [v3, anywhere, unknown]
+        assert m.remove_host("e.com") == [v3, anywhere]
+        with pytest.raises(ConnectionError):
+            await asks.get("http://e.com/v3/1")
+        # the host of this one is not known from its literal start
+        assert m.routes() == [kept, unknown]
+        m.remove_prefix("http://e.")
+
+
 @pytest.mark.asyncio
 async def test_multiple_urls(asynclib):
     @replies.activate
@@ -773,6 +1612,388 @@ async def test_multiple_urls(asynclib):
     await run()
     assert_reset()
 
+@pytest.mark.asyncio
+async def test_multiple_replies_with_regex(asynclib):
+    @replies.activate
+    async def run():
+        replies.add(replies.GET, re.compile(r"http://example\.com/.*"), body="regex")
+        replies.add(replies.GET, "http://example.com/one", body="one")
+
+        resp = await asks.get("http://example.com/one")
+        assert_response(resp, "regex")
+        resp = await asks.get("http://example.com/one")
+        assert_response(resp, "one")
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_many_regular_expression_urls(asynclib):
+    @replies.activate
+    async def run():
+        for i in range(50):
+            replies.add(
+                replies.GET, re.compile(r"http://example\.com/{0}$".format(i)), body=str(i)
+            )
+        replies.add(replies.GET, re.compile(r"(?i)HTTP://EXAMPLE\.COM/X"), body="x")
+
+        resp = await asks.get("http://example.com/42")
+        assert_response(resp, "42")
+        resp = await asks.get("http://example.com/x")
+        assert_response(resp, "x")
+        with pytest.raises(ConnectionError):
+            await asks.get("http://example.com/420")
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_regex_prefixes(asynclib):
+    with replies.AsksMock(assert_all_requests_are_fired=False) as m:
+        m.add(replies.GET, re.compile(r"^http://example\.com/a/\d+"), body="digits")
+        m.add(replies.GET, re.compile(r"(?i)HTTP://EXAMPLE\.COM/A/1"), body="nocase")
+        m.add(replies.GET, re.compile(r"https?://example\.com/"), body="any")
+        m.add(replies.GET, re.compile(r"http://other\.com/"), body="other")
+
+        # routes from every bucket still match in registration order
+        for body in ("digits", "nocase", "any", "any"):
+            assert_response(await asks.get("http://example.com/a/1"), body)
+        assert_response(await asks.get("http://other.com/"), "other")
+        with pytest.raises(ConnectionError):
+            await asks.get("http://example.org/")
+
+
+@pytest.mark.asyncio
+async def test_unmatched_then_added(asynclib):
+    @replies.activate
+    async def run():
+        with pytest.raises(ConnectionError):
+            await asks.get("http://example.com/one")
+
+        replies.add(replies.GET, "http://example.com/one", body="one")
+        resp = await asks.get("http://example.com/one")
+        assert_response(resp, "one")
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_unmatched_cache_is_bounded(asynclib):
+    with replies.AsksMock() as m:
+        misses = m._matches._misses
+        for i in range(misses.maxsize + 10):
+            with pytest.raises(ConnectionError):
+                await asks.get("http://example.com/?i={0}".format(i))
+        assert len(misses) == misses.maxsize
+        assert ("GET", "http://example.com/?i=0") not in misses
+        last = misses.maxsize + 9
+        assert ("GET", "http://example.com/?i={0}".format(last)) in misses
+
+
+@pytest.mark.asyncio
+async def test_session_methods(asynclib):
+    @replies.activate
+    async def run():
+        replies.add(replies.POST, "http://example.com/one", body="one")
+
+        session = asks.Session(base_location="http://example.com")
+        resp = await session.post(path="/one", params={"a": "b"}, json={"x": 1})
+        assert_response(resp, "one")
+        assert len(replies.calls) == 1
+        assert replies.calls[0].request.url == "http://example.com/one?a=b"
+        assert replies.calls[0].request.body == b'{"x": 1}'
+        assert replies.calls[0].request.headers["Content-Type"] == "application/json"
+
+    await run()
+    assert_reset()
+
+
+def test_session_make_url_with_path(monkeypatch):
+    # asks 3 passes the path to ``_make_url`` and normalizes the slashes
+    class PathSession(asks.Session):
+        def _make_url(self, path):
+            return self.base_location.rstrip("/") + "/" + path.lstrip("/")
+
+    monkeypatch.setattr(replies._asks, "_MAKE_URL_TAKES_PATH", True)
+    session = PathSession(base_location="http://example.com/")
+    request = replies._asks.Request.from_session(session, "GET", path="/one")
+    assert request.url == "http://example.com/one"
+
+
+@pytest.mark.asyncio
+async def test_shared_body(asynclib):
+    @replies.activate
+    async def run():
+        body = bytearray(b"x" * 100000)
+        reply = Reply(replies.GET, "http://example.com", body=body)
+        replies.add(reply)
+        body[0] = ord("y")
+
+        first = await asks.get("http://example.com")
+        second = await asks.get("http://example.com", stream=True)
+        assert first.content is reply.body
+        assert b"".join([chunk async for chunk in second.body]) == b"x" * 100000
+
+    await run()
+    assert_reset()
+
+
+@pytest.mark.asyncio
+async def test_stream(asynclib):
+    @replies.activate
+    async def run():
+        body = b"x" * 25000
+        replies.add(replies.GET, "http://example.com", body=body, stream=True)
+
+        resp = await asks.get("http://example.com")
+        chunks = [chunk async for chunk in resp.body]
+        assert b"".join(chunks) == body
+        assert len(chunks) == 3
+
+        replies.add(replies.GET, "http://example.com/two", body=body)
+        resp = await asks.get("http://example.com/two", stream=True)
+        async with resp.body as content:
+            assert b"".join([chunk async for chunk in content]) == body
+
+    await run()
+    assert_reset()
+
+
+def test_record_and_replay(asynclib, httpserver, tmpdir):
+    async def run():
+        path = str(tmpdir.join("server.cassette"))
+        httpserver.serve_content("recorded", headers={"Content-Type": "text/plain"})
+
+        with replies.AsksMock(passthru_prefixes=(httpserver.url,)) as m:
+            m.record(path)
+            resp = await asks.get(httpserver.url + "/a")
+            assert_response(resp, "recorded")
+            httpserver.serve_content("again", code=201)
+            await asks.get(httpserver.url + "/a")
+            await asks.post(httpserver.url + "/b", data="x")
+
+        with replies.AsksMock() as m:
+            m.replay(path)
+            for body, status in [("recorded", 200), ("again", 201), ("again", 201)]:
+                resp = await asks.get(httpserver.url + "/a")
+                assert resp.status_code == status
+                assert resp.content == body.encode("utf-8")
+            resp = await asks.post(httpserver.url + "/b", data="x")
+            assert resp.content == b"again"
+            assert len(m.calls) == 4
+            with pytest.raises(ConnectionError):
+                await asks.post(httpserver.url + "/b", data="y")
+
+    multio.run(run)
+
+    tmpdir.join("bad.cassette").write("nope")
+    with pytest.raises(ValueError):
+        replies.AsksMock().replay(str(tmpdir.join("bad.cassette")))
+
+
+@pytest.mark.asyncio
+async def test_load(asynclib, tmpdir, monkeypatch):
+    spec = tmpdir.join("replies.json")
+    spec.write(
+        json.dumps(
+            {
+                "replies": [
+                    {"method": "GET", "url": "http://example.com/a", "body": "a"},
+                    {"method": "GET", "url": "http://example.com/j", "json": [1]},
+                    {
+                        "method": "POST",
+                        "url": r"http://example\.com/items/\d+",
+                        "regex": True,
+                        "status": 201,
+                    },
+                ]
+            }
+        )
+    )
+    cache_dir = str(tmpdir.join("cache"))
+
+    async def check(m):
+        assert_response(await asks.get("http://example.com/a"), "a")
+        assert_response(await asks.get("http://example.com/j"), "[1]", "application/json")
+        resp = await asks.post("http://example.com/items/12")
+        assert resp.status_code == 201
+
+    with replies.AsksMock() as m:
+        m.load(str(spec), cache_dir=cache_dir)
+        await check(m)
+    assert len(tmpdir.join("cache").listdir()) == 1
+
+    # the same content is served from the cache, without parsing the file
+    monkeypatch.setattr("replies._loader.parse_specs", None)
+    with replies.AsksMock() as m:
+        m.load(str(spec), cache_dir=cache_dir)
+        await check(m)
+    monkeypatch.undo()
+
+    # another version of replies does not load these pickles
+    monkeypatch.setattr("replies._loader.__version__", "0.0.0")
+    replies.AsksMock().load(str(spec), cache_dir=cache_dir)
+    assert len(tmpdir.join("cache").listdir()) == 2
+    monkeypatch.undo()
+
+    # a pickle other users could have written is not loaded
+    if hasattr(os, "getuid"):
+        planted = Reply(replies.GET, "http://example.com/a", body="planted")
+        for cached in tmpdir.join("cache").listdir():
+            cached.write_binary(pickle.dumps([planted]))
+            cached.chmod(0o666)
+        with replies.AsksMock() as m:
+            m.load(str(spec), cache_dir=cache_dir)
+            await check(m)
+
+    with replies.AsksMock() as m:
+        m.add_many(
+            [
+                {"method": "GET", "url": "http://example.com/a", "body": "a"},
+                Reply(replies.GET, "http://example.com/j", json=[1]),
+                {"method": "POST", "url": r".*/items/\d+", "regex": True, "status": 201},
+            ]
+        )
+        await check(m)
+
+    with pytest.raises(ValueError):
+        replies.AsksMock().load(str(tmpdir.join("replies.ini").ensure()))
+
+
+@pytest.mark.asyncio
+async def test_load_toml(asynclib, tmpdir):
+    pytest.importorskip("toml")
+    spec = tmpdir.join("replies.toml")
+    spec.write(
+        "[[replies]]\n"
+        'method = "GET"\n'
+        'url = "http://example.com/"\n'
+        'body = "from toml"\n'
+        "rate_limit = [1, 60]\n"
+    )
+    with replies.AsksMock() as m:
+        m.load(str(spec), cache_dir=None)
+        assert_response(await asks.get("http://example.com/"), "from toml")
+        resp = await asks.get("http://example.com/")
+        assert resp.status_code == 429
+
+
+def test_passthru_dispatcher(asynclib, httpserver):
+    async def run():
+        httpserver.serve_content("real", headers={"Content-Type": "text/plain"})
+        upstream = ("http", httpserver.url.split("://")[1])
+
+        with replies.AsksMock(passthru_connections=2) as m:
+            m.add_passthru("http://elsewhere.com/")
+            m.add_passthru(httpserver.url + "/api")
+            m.add(replies.GET, httpserver.url + "/api/mocked", body="mocked")
+
+            assert_response(await asks.get(httpserver.url + "/api/mocked"), "mocked")
+            for _ in range(3):
+                assert_response(await asks.get(httpserver.url + "/api/real"), "real")
+            with pytest.raises(ConnectionError):
+                await asks.get(httpserver.url + "/other")
+
+            # the three requests went through one pooled session
+            assert len(m._passthru._sessions) == 1
+            timing = m.passthru_timings[upstream]
+            assert timing.count == 3
+            assert 0 < timing.min <= timing.mean <= timing.max
+            assert m.passthru_prefixes == ("http://elsewhere.com/", httpserver.url + "/api")
+
+    multio.run(run)
+
+    # resetting closes the pooled connections, whatever wraps their socket
+    dispatcher = replies._passthru.PassthruDispatcher()
+    session = dispatcher._session(("http", "a.com"))
+    pair = socket.socketpair()
+    trio_like = SimpleNamespace(socket=SimpleNamespace(_sock=pair[0]))
+    session._conn_pool.extend([trio_like, SimpleNamespace(_socket=pair[1])])
+    dispatcher.reset()
+    assert not dispatcher._sessions
+    assert not session._conn_pool
+    assert [sock.fileno() for sock in pair] == [-1, -1]
+
+    index = replies._passthru.PrefixIndex(["http://a.com/x", "https://b", "http://a.com/"])
+    assert index.match("http://a.com/x/1") == "http://a.com/x"
+    assert index.match("http://a.com/y") == "http://a.com/"
+    assert index.match("https://b.org/") == "https://b"
+    assert index.match("https://a.com/x") is None
+
+
+@pytest.mark.parametrize("backend", ["asyncio", "trio"])
+def test_passthru_reset_closes_anyio_streams(backend, httpserver, httpsserver):
+    # asks 3 pools anyio streams, over tls for https upstreams
+    anyio = pytest.importorskip("anyio")
+    from anyio.abc import SocketAttribute
+    import ssl
+
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    async def run():
+        dispatcher = replies._passthru.PassthruDispatcher()
+        session = dispatcher._session(("http", "a.com"))
+        streams = [
+            await anyio.connect_tcp(*httpserver.server_address),
+            await anyio.connect_tcp(*httpsserver.server_address, tls=True, ssl_context=context),
+        ]
+        raw = [stream.extra(SocketAttribute.raw_socket) for stream in streams]
+        # connections that cannot be unwrapped are left alone
+        session._conn_pool.extend(streams + [object()])
+        dispatcher.reset()
+        assert not session._conn_pool
+        # asyncio transports close their socket on the next loop iteration
+        await anyio.sleep(0.01)
+        assert [sock.fileno() for sock in raw] == [-1, -1]
+
+    anyio.run(run, backend=backend)
+
+
+# seconds ``import replies`` may take, an order of magnitude above the
+# measured cost so slow machines do not fail it
+IMPORT_BUDGET = 0.05
+
+
+def test_import_budget():
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import replies\n"
+        "elapsed = time.perf_counter() - start\n"
+        "heavy = ('asks', 'cookies', 'six', 'unittest.mock', 'replies.mock')\n"
+        "print(elapsed, *[m for m in heavy if m in sys.modules])\n"
+        "replies.add\n"
+        "print(*[m for m in heavy if m in sys.modules])\n"
+    )
+    before, after = subprocess.check_output(
+        [sys.executable, "-c", script], universal_newlines=True
+    ).splitlines()
+    elapsed, *loaded = before.split()
+    assert loaded == []
+    assert float(elapsed) < IMPORT_BUDGET
+    # the default mock and its dependencies come with the first use
+    assert {"asks", "replies.mock"} <= set(after.split())
+    assert isinstance(replies.mock, replies.AsksMock)
+
+
+def test_import_mock_submodule():
+    script = (
+        "import replies.mock\n"
+        "from replies.mock import AsksMock\n"
+        "print(type(replies.mock).__name__, replies.mock is replies._default_mock)\n"
+        "import replies.mock\n"
+        "print(type(replies.mock).__name__, replies.add.__self__ is replies.mock)\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script], universal_newlines=True)
+    # the submodule never shadows the default mock
+    assert output.splitlines() == ["AsksMock True", "AsksMock True"]
+
+
 @pytest.mark.asyncio
 async def test_passthru(asynclib, httpserver):
     httpserver.serve_content("OK", headers={"Content-Type": "text/plain"})